@@ -1,7 +1,12 @@
 # Communication with Thymio via serial port or tcp
 # Author: Yves Piguet, EPFL
 
+import array
+import contextlib
+import struct
+import sys
 import threading
+import time
 
 class Message:
     """Aseba message data.
@@ -22,6 +27,7 @@ class Message:
     ID_VARIABLES = 0x9005
     ID_EXECUTION_STATE_CHANGED = 0x900a
     ID_NODE_PRESENT = 0x900c
+    ID_CHANGED_VARIABLES = 0x900e
     ID_GET_DESCRIPTION = 0xa000
     ID_SET_BYTECODE = 0xa001
     ID_RESET = 0xa002
@@ -47,6 +53,10 @@ class Message:
 
     PROTOCOL_VERSION = 5
 
+    # little-endian words of the payload and of the message header (length, source, id)
+    UINT16 = struct.Struct("<H")
+    HEADER = struct.Struct("<HHH")
+
     def __init__(self, id, source_node, payload):
         self.id = id
         self.source_node = source_node
@@ -55,7 +65,20 @@ class Message:
     def get_uint16(self, offset):
         """Get an unsigned 16-bit integer in the payload.
         """
-        return self.payload[offset] + 256 * self.payload[offset + 1], offset + 2
+        return Message.UINT16.unpack_from(self.payload, offset)[0], offset + 2
+
+    def get_uint16_array(self, offset, count=None):
+        """Get a tuple of unsigned 16-bit integers in the payload, by default up to its end.
+        """
+        if count is None:
+            count = (len(self.payload) - offset) // 2
+        return struct.unpack_from(f"<{count}H", self.payload, offset), offset + 2 * count
+
+    @property
+    def var_data(self):
+        """Words of an ID_VARIABLES message, unpacked only when needed.
+        """
+        return self.get_uint16_array(2)[0]
 
     def get_string(self, offset):
         """Get a string in the payload.
@@ -68,29 +91,25 @@ class Message:
     def uint16_to_bytes(word):
         """Convert an unsigned 16-bit integer to bytes.
         """
-        return bytes([word % 256, word // 256])
+        return Message.UINT16.pack(word & 0xffff)
 
     @staticmethod
     def uint16array_to_bytes(a):
         """Convert an array of unsigned 16-bit integer to bytes.
         """
-        bytes = b"";
-        for word in a:
-            bytes += Message.uint16_to_bytes(word)
-        return bytes
+        try:
+            return struct.pack(f"<{len(a)}H", *a)
+        except struct.error:
+            # negative values are sent as their two's complement
+            return struct.pack(f"<{len(a)}H", *[word & 0xffff for word in a])
 
     def decode(self):
         """Decode message properties from its payload.
         """
         if self.id == Message.ID_DESCRIPTION:
             self.node_name, offset = self.get_string(0)
-            self.protocol_version, offset = self.get_uint16(offset)
-            self.bytecode_size, offset = self.get_uint16(offset)
-            self.stack_size, offset = self.get_uint16(offset)
-            self.var_size, offset = self.get_uint16(offset)
-            self.num_named_var, offset = self.get_uint16(offset)
-            self.num_local_events, offset = self.get_uint16(offset)
-            self.num_native_fun, offset = self.get_uint16(offset)
+            (self.protocol_version, self.bytecode_size, self.stack_size, self.var_size,
+             self.num_named_var, self.num_local_events, self.num_native_fun), offset = self.get_uint16_array(offset, 7)
         elif self.id == Message.ID_NAMED_VARIABLE_DESCRIPTION:
             self.var_size, offset = self.get_uint16(0)
             self.var_name, offset = self.get_string(offset)
@@ -109,21 +128,23 @@ class Message:
                 self.param_names.append(name)
                 self.param_sizes.append(size)
         elif self.id == Message.ID_VARIABLES:
+            # words kept as little-endian bytes, copied as they are by RemoteNode.set_var_bytes
             self.var_offset, offset = self.get_uint16(0)
-            self.var_data = []
-            for i in range(len(self.payload) // 2 - 1):
-                word, offset = self.get_uint16(offset)
-                self.var_data.append(word)
+            self.var_bytes = memoryview(self.payload)[offset:]
+        elif self.id == Message.ID_CHANGED_VARIABLES:
+            # sequence of (offset, count, count words)
+            self.var_chunks = []
+            offset = 0
+            with memoryview(self.payload) as view:
+                while offset + 4 <= len(self.payload):
+                    (var_offset, count), offset = self.get_uint16_array(offset, 2)
+                    self.var_chunks.append((var_offset, view[offset : offset + 2 * count]))
+                    offset += 2 * count
         elif self.id == Message.ID_NODE_PRESENT:
             self.version, offset = self.get_uint16(0)
         elif self.id == Message.ID_SET_BYTECODE:
-            self.target_node_id, offset = self.get_uint16(0)
-            self.bc_offset, offset = self.get_uint16(offset)
-            val = []
-            for i in range(4, len(self.payload), 2):
-                instr, offset = get_uint16(offset)
-                val.append(instr)
-            self.bc = val
+            (self.target_node_id, self.bc_offset), offset = self.get_uint16_array(0, 2)
+            self.bc, offset = self.get_uint16_array(offset)
         elif (self.id == Message.ID_BREAKPOINT_CLEAR_ALL or
               self.id == Message.ID_RESET or
               self.id == Message.ID_RUN or
@@ -134,30 +155,19 @@ class Message:
             self.target_node_id, offset = self.get_uint16(0)
         elif (self.id == Message.ID_BREAKPOINT_SET or
               self.id == Message.ID_BREAKPOINT_CLEAR):
-            self.target_node_id, offset = self.get_uint16(0)
-            self.pc, offset = self.get_uint16(offset)
+            (self.target_node_id, self.pc), offset = self.get_uint16_array(0, 2)
         elif self.id == Message.ID_GET_VARIABLES:
-            self.target_node_id, offset = self.get_uint16(0)
-            self.var_offset, offset = self.get_uint16(offset)
-            self.var_count, offset = self.get_uint16(offset)
+            (self.target_node_id, self.var_offset, self.var_count), offset = self.get_uint16_array(0, 3)
         elif self.id == Message.ID_SET_VARIABLES:
-            self.target_node_id, offset = self.get_uint16(0)
-            self.var_offset, offset = self.get_uint16(offset)
-            val = []
-            for i in range(4, len(self.payload), 2):
-                v, offset = get_uint16(offset)
-                val.append(v)
-            self.var_val = val
+            (self.target_node_id, self.var_offset), offset = self.get_uint16_array(0, 2)
+            self.var_val, offset = self.get_uint16_array(offset)
         elif self.id == Message.ID_LIST_NODES:
             self.version, offset = self.get_uint16(0)
 
     def serialize(self):
         """Serialize message to bytes.
         """
-        return (self.uint16_to_bytes(len(self.payload)) +
-                self.uint16_to_bytes(self.source_node) +
-                self.uint16_to_bytes(self.id) +
-                self.payload)
+        return Message.HEADER.pack(len(self.payload), self.source_node, self.id) + self.payload
 
     @staticmethod
     def id_to_str(id):
@@ -172,6 +182,7 @@ class Message:
                 Message.ID_VARIABLES: "ID_VARIABLES",
                 Message.ID_EXECUTION_STATE_CHANGED: "ID_EXECUTION_STATE_CHANGED",
                 Message.ID_NODE_PRESENT: "ID_NODE_PRESENT",
+                Message.ID_CHANGED_VARIABLES: "ID_CHANGED_VARIABLES",
                 Message.ID_GET_DESCRIPTION: "ID_GET_DESCRIPTION",
                 Message.ID_SET_BYTECODE: "ID_SET_BYTECODE",
                 Message.ID_RESET: "ID_RESET",
@@ -187,6 +198,7 @@ class Message:
                 Message.ID_SET_VARIABLES: "ID_SET_VARIABLES",
                 Message.ID_GET_NODE_DESCRIPTION: "ID_GET_NODE_DESCRIPTION",
                 Message.ID_LIST_NODES: "ID_LIST_NODES",
+                Message.ID_GET_CHANGED_VARIABLES: "ID_GET_CHANGED_VARIABLES",
             }[id]
         except KeyError as error:
             return f"ID {id}"
@@ -221,58 +233,249 @@ class Message:
         return str
 
 
+class Stream:
+    """Byte stream with the same interface for every transport.
+
+    readinto(b) blocks until some data is available and returns the number of
+    bytes read, up to len(b), or 0 at the end of the stream.
+    """
+
+    def __init__(self, io):
+        self.io = io
+
+    @staticmethod
+    def wrap(io):
+        """Get the Stream of a serial port, a socket or a raw io object.
+        """
+        if isinstance(io, Stream):
+            return io
+        if hasattr(io, "recv_into"):
+            return SocketStream(io)
+        if hasattr(io, "in_waiting"):
+            return SerialStream(io)
+        return Stream(io)
+
+    def readinto(self, b):
+        data = self.io.read(len(b))
+        if not data:
+            return 0
+        b[:len(data)] = data
+        return len(data)
+
+    def write(self, b):
+        self.io.write(b)
+
+    def close(self):
+        self.io.close()
+
+
+class SerialStream(Stream):
+    """Stream over a pyserial port, reads what is waiting in one call.
+    """
+
+    def readinto(self, b):
+        # block for the first byte only, then take everything already received
+        data = self.io.read(min(max(self.io.in_waiting, 1), len(b)))
+        b[:len(data)] = data
+        return len(data)
+
+
+class SocketStream(Stream):
+    """Stream over a connected TCP socket.
+    """
+
+    def readinto(self, b):
+        return self.io.recv_into(b)
+
+    def write(self, b):
+        self.io.sendall(b)
+
+    def close(self):
+        try:
+            # wakes up the input thread blocked in recv_into (2: socket.SHUT_RDWR)
+            self.io.shutdown(2)
+        except OSError:
+            pass
+        self.io.close()
+
+
+class FrameParser:
+    """Reassembly of messages from the chunks read from a stream.
+
+    Chunks are read into a reusable buffer and every complete frame in it is
+    extracted; a partial frame stays in the buffer until the rest arrives.
+    """
+
+    HEADER_SIZE = 6
+
+    def __init__(self, size=4096):
+        self.buffer = bytearray(size)
+        self.start = 0
+        self.end = 0
+
+    def free_space(self, size):
+        # move the pending partial frame to the front, grow the buffer for a large frame
+        if self.start > 0:
+            pending = self.end - self.start
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+        if len(self.buffer) - self.end < size:
+            self.buffer.extend(bytes(size - (len(self.buffer) - self.end)))
+
+    def fill(self, stream):
+        """Read one chunk from a stream, return its size (0 at the end of the stream).
+        """
+        if self.end == len(self.buffer) or self.start > len(self.buffer) // 2:
+            self.free_space(max(self.pending_size() - (self.end - self.start), 1))
+        with memoryview(self.buffer) as view:
+            n = stream.readinto(view[self.end:])
+        self.end += n or 0
+        return n or 0
+
+    def feed(self, data):
+        """Append bytes received by other means.
+        """
+        self.free_space(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def pending_size(self):
+        # size of the frame at the start of the buffer, or of its header if incomplete
+        if self.end - self.start < FrameParser.HEADER_SIZE:
+            return FrameParser.HEADER_SIZE
+        return FrameParser.HEADER_SIZE + Message.UINT16.unpack_from(self.buffer, self.start)[0]
+
+    def messages(self):
+        """Extract the complete messages in the buffer.
+        """
+        messages = []
+        while self.end - self.start >= FrameParser.HEADER_SIZE:
+            payload_len, source_node, id = Message.HEADER.unpack_from(self.buffer, self.start)
+            frame_end = self.start + FrameParser.HEADER_SIZE + payload_len
+            if frame_end > self.end:
+                break
+            payload = bytes(self.buffer[self.start + FrameParser.HEADER_SIZE:frame_end])
+            messages.append(Message(id, source_node, payload))
+            self.start = frame_end
+        if self.start == self.end:
+            self.start = self.end = 0
+        return messages
+
+
 class InputThread(threading.Thread):
     """Thread which reads messages asynchronously.
     """
 
     def __init__(self, io, handle_msg=None):
         threading.Thread.__init__(self)
-        self.io = io
+        self.io = Stream.wrap(io)
         self.handle_msg = handle_msg
+        self.parser = FrameParser()
+        self.pending = []
+        self.reads = 0
 
-    def read_uint16(self):
-        """Read an unsigned 16-bit number.
+    def read_messages(self):
+        """Read a chunk and return the complete messages received, None at the end of the stream.
         """
-        b = self.io.read(2)
-        return b[0] + 256 * b[1]
+        try:
+            n = self.parser.fill(self.io)
+        except (OSError, ValueError):
+            # connection closed
+            return None
+        if n == 0:
+            return None
+        self.reads += 1
+        return self.parser.messages()
 
     def read_message(self):
         """Read a complete message.
         """
-        try:
-            payload_len = self.read_uint16()
-            source_node = self.read_uint16()
-            id = self.read_uint16()
-            payload = self.io.read(payload_len)
-        except:
-            return None
-        msg = Message(id, source_node, payload)
-        return msg
+        while not self.pending:
+            messages = self.read_messages()
+            if messages is None:
+                return None
+            self.pending = messages
+        return self.pending.pop(0)
 
     def run(self):
         """Input thread code.
         """
         while True:
-            msg = self.read_message()
-            if msg:
-                msg.decode()
+            messages = self.read_messages()
+            if messages is None:
+                break
+            for msg in messages:
+                try:
+                    msg.decode()
+                except (struct.error, UnicodeDecodeError, ValueError) as error:
+                    print(f"Bad message {Message.id_to_str(msg.id)}: {error}")
+                    continue
                 if self.handle_msg:
                     self.handle_msg(msg)
-            else:
-                break
 
 
 class RemoteNode:
     """Remote node description and state.
+
+    Variables are stored in a typed array of unsigned 16-bit words, updated in
+    place. var_view returns cached memoryviews of a variable, unsigned or
+    signed (int16), which follow the updates without copying.
+    The array is allocated for the whole variable space once the description
+    of the node is received (set_var_space), and never resized afterwards.
     """
 
+    __slots__ = ("node_id", "node_name", "protocol_version", "var_total_size", "var_offset", "var_size",
+                 "var_space", "var_data", "signed_data", "views")
+
+    # the words of var_data can be copied as raw bytes from the messages (little-endian)
+    LITTLE_ENDIAN = sys.byteorder == "little"
+
     def __init__(self):
         self.node_id = None
         self.node_name = None
+        self.protocol_version = None
         self.var_total_size = 0
         self.var_offset = {}
         self.var_size = {}
-        self.var_data = []
+        self.var_space = None
+        self.var_data = array.array("H")
+        self.signed_data = None
+        self.views = {}
+
+    def release_views(self):
+        # the array cannot be resized while memoryviews on it exist
+        for view in self.views.values():
+            view.release()
+        self.views = {}
+        if self.signed_data is not None:
+            self.signed_data.release()
+            self.signed_data = None
+
+    def grow(self, size):
+        # the cached views are released first; if the caller still holds views derived
+        # from them, the array cannot be resized and is kept as it is
+        if size <= len(self.var_data):
+            return
+        self.release_views()
+        try:
+            self.var_data.extend(array.array("H", [0]) * (size - len(self.var_data)))
+        except BufferError:
+            print("Variable views in use, variable data not resized")
+
+    def set_var_space(self, size):
+        """Allocate the whole variable space, whose size is given by the node description.
+
+        The views of the variables stay valid afterwards: words past the
+        variable space are ignored instead of resizing the data array.
+        """
+        self.var_space = size
+        self.grow(size)
+
+    def writable_count(self, offset, count):
+        # number of words which can be written at offset, growing the array before the variable space is known
+        if self.var_space is None:
+            self.grow(offset + count)
+        return max(min(count, len(self.var_data) - offset), 0)
 
     def add_var(self, name, size):
         """Add the definition of a variable.
@@ -280,38 +483,81 @@ class RemoteNode:
         self.var_offset[name] = self.var_total_size
         self.var_size[name] = size
         self.var_total_size += size
+        self.grow(self.var_total_size)
 
     def reset_var_data(self):
-        """Reset the variable data to 0.
+        """Reset the variable data to 0, in place.
         """
-        self.var_data = [0 for i in range(self.var_total_size)]
+        self.var_data[:] = array.array("H", [0]) * len(self.var_data)
+
+    def var_view(self, name, signed=False):
+        """Get a memoryview of a variable, of signed words if signed.
 
-    def get_var(self, name, index=0):
+        The view is cached and stays up to date: reading it allocates nothing.
+        Views taken before set_var_space may be released when the data array
+        grows; take them after the handshake.
+        """
+        key = (name, signed)
+        view = self.views.get(key)
+        if view is None:
+            offset = self.var_offset[name]
+            if signed:
+                if self.signed_data is None:
+                    self.signed_data = memoryview(self.var_data).cast("B").cast("h")
+                data = self.signed_data
+            else:
+                data = memoryview(self.var_data)
+            view = self.views[key] = data[offset : offset + self.var_size[name]]
+        return view
+
+    def get_var(self, name, index=0, signed=False):
         """Get the value of a scalar variable or an item in an array variable.
         """
-        return self.var_data[self.var_offset[name] + index]
+        word = self.var_data[self.var_offset[name] + index]
+        return word - 0x10000 if signed and word >= 0x8000 else word
 
-    def get_var_array(self, name):
+    def get_var_array(self, name, signed=False):
         """Get the value of an array variable.
         """
-        offset = self.var_offset[name]
-        return self.var_data[offset : offset + self.var_size[name]]
+        return self.var_view(name, signed).tolist()
 
     def set_var(self, name, val, index=0):
         """Set the value of a scalar variable or an item in an array variable.
+
+        Negative values are stored as their two's complement.
         """
-        self.var_data[self.var_offset[name] + index] = val
+        self.var_data[self.var_offset[name] + index] = val & 0xffff
 
     def set_var_array(self, name, val):
         """Set the value of an array variable.
         """
-        offset = self.var_offset[name]
-        self.var_data[offset : offset + len(val)] = val
+        self.set_var_data(self.var_offset[name], val)
 
     def set_var_data(self, offset, data):
         """Set values in the variable data array.
         """
-        self.var_data[offset : offset + len(data)] = data
+        count = self.writable_count(offset, len(data))
+        if count < len(data):
+            data = data[:count]
+        try:
+            self.var_data[offset : offset + len(data)] = array.array("H", data)
+        except OverflowError:
+            self.var_data[offset : offset + len(data)] = array.array("H", [word & 0xffff for word in data])
+
+    def set_var_bytes(self, offset, data):
+        """Set values in the variable data array from little-endian words, in place.
+
+        A trailing odd byte is ignored.
+        """
+        count = len(data) // 2
+        data = data[:2 * count]
+        if not RemoteNode.LITTLE_ENDIAN:
+            self.set_var_data(offset, struct.unpack(f"<{count}H", data))
+            return
+        count = self.writable_count(offset, count)
+        data = data[:2 * count]
+        with memoryview(self.var_data) as view:
+            view.cast("B")[2 * offset : 2 * (offset + count)] = data
 
 
 class Thymio:
@@ -320,7 +566,7 @@ class Thymio:
 
     def __init__(self, io, node_id=1, refreshing_rate=None):
         self.terminating = False
-        self.io = io
+        self.io = Stream.wrap(io)
         self.node_id = node_id
         self.remote_node = RemoteNode()
         self.auto_handshake = False
@@ -333,11 +579,25 @@ class Thymio:
         self.output_lock = threading.Lock()
         self.refreshing_timeout = None
         self.refreshing_trigger = threading.Event()  # initially wait() blocks
+        # name: [period in s, time of the next request]
+        self.subscriptions = {}
+        self.subscriptions_lock = threading.Lock()
+        self.use_changed_variables = True
+        # writes of the current batch of each thread, and of the outgoing queue (offset: word)
+        self.batch_local = threading.local()
+        self.write_cond = threading.Condition()
+        self.write_queue = False
+        self.queued_writes = {}
+        self.sending_writes = False
+        self.dropped_writes = 0
+        self.write_thread = None
         def do_refresh():
             while not self.terminating:
-                self.refreshing_trigger.wait(self.refreshing_timeout)
+                self.refreshing_trigger.wait(self.next_refresh_timeout())
                 self.refreshing_trigger.clear()
-                self.get_variables()
+                if self.terminating:
+                    break
+                self.refresh()
         self.refresh_thread = threading.Thread(target=do_refresh)
         self.refresh_thread.start()
         if refreshing_rate is not None:
@@ -425,6 +685,87 @@ class Thymio:
             # refresh now
             self.refreshing_trigger.set()
 
+    def subscribe(self, names, rate):
+        """Refresh only the given variables, each list of names with its own period in s.
+
+        Once there are subscriptions, the refresh thread stops requesting the
+        whole variable space and the refreshing rate is ignored.
+        """
+        if isinstance(names, str):
+            names = [names]
+        now = time.monotonic()
+        with self.subscriptions_lock:
+            for name in names:
+                self.subscriptions[name] = [rate, now]
+        self.refreshing_trigger.set()
+
+    def unsubscribe(self, names=None):
+        """Stop refreshing some variables, by default all of them.
+        """
+        with self.subscriptions_lock:
+            if names is None:
+                self.subscriptions.clear()
+            else:
+                for name in [names] if isinstance(names, str) else names:
+                    self.subscriptions.pop(name, None)
+
+    def next_refresh_timeout(self):
+        with self.subscriptions_lock:
+            if not self.subscriptions:
+                return self.refreshing_timeout
+            return max(0.0, min(next_time for period, next_time in self.subscriptions.values()) - time.monotonic())
+
+    @staticmethod
+    def merge_ranges(ranges, max_gap=4):
+        """Merge (offset, size) ranges which overlap or are separated by at most max_gap words.
+
+        Reading a few unneeded words costs less than the header of another request.
+        """
+        merged = []
+        for offset, size in sorted(ranges):
+            if merged and offset <= merged[-1][0] + merged[-1][1] + max_gap:
+                end = max(merged[-1][0] + merged[-1][1], offset + size)
+                merged[-1] = (merged[-1][0], end - merged[-1][0])
+            else:
+                merged.append((offset, size))
+        return merged
+
+    def supports_changed_variables(self):
+        """Check if the node answers GET_CHANGED_VARIABLES (protocol version 7 or later).
+        """
+        with self.input_lock:
+            return (self.remote_node.protocol_version is not None and
+                    self.remote_node.protocol_version >= 7)
+
+    def refresh(self):
+        """Request the variables which are due: the subscribed ones, or the whole space without subscriptions.
+        """
+        now = time.monotonic()
+        with self.subscriptions_lock:
+            if not self.subscriptions:
+                due = None
+            else:
+                due = []
+                for name, subscription in self.subscriptions.items():
+                    period, next_time = subscription
+                    if next_time <= now:
+                        due.append(name)
+                        # keep the phase, but skip the periods which were missed
+                        subscription[1] = max(next_time + period, now)
+        if due is None:
+            self.get_variables()
+            return
+        if not due:
+            return
+        if self.use_changed_variables and self.supports_changed_variables():
+            self.get_changed_variables()
+            return
+        with self.input_lock:
+            ranges = [(self.remote_node.var_offset[name], self.remote_node.var_size[name])
+                      for name in due if name in self.remote_node.var_offset]
+        for offset, size in self.merge_ranges(ranges):
+            self.get_variables(offset, size)
+
     def handle_message(self, msg):
         """Handle an input message.
         """
@@ -435,13 +776,19 @@ class Thymio:
                 self.get_node_description()
         elif msg.id == Message.ID_DESCRIPTION:
             with self.input_lock:
-                self.remote_node.name = msg.node_name
+                self.remote_node.node_name = msg.node_name
+                self.remote_node.protocol_version = msg.protocol_version
+                self.remote_node.set_var_space(msg.var_size)
         elif msg.id == Message.ID_NAMED_VARIABLE_DESCRIPTION:
             with self.input_lock:
                 self.remote_node.add_var(msg.var_name, msg.var_size)
         elif msg.id == Message.ID_VARIABLES:
             with self.input_lock:
-                self.remote_node.set_var_data(msg.var_offset, msg.var_data)
+                self.remote_node.set_var_bytes(msg.var_offset, msg.var_bytes)
+        elif msg.id == Message.ID_CHANGED_VARIABLES:
+            with self.input_lock:
+                for var_offset, data in msg.var_chunks:
+                    self.remote_node.set_var_bytes(var_offset, data)
         elif msg.id == Message.ID_NATIVE_FUNCTION_DESCRIPTION:
             pass  # ignore
         elif msg.id == Message.ID_LOCAL_EVENT_DESCRIPTION:
@@ -498,6 +845,16 @@ class Thymio:
             msg = Message(Message.ID_GET_VARIABLES, self.node_id, payload)
             self.send(msg)
 
+    def get_changed_variables(self, target_node_id=None):
+        """Send a GET_CHANGED_VARIABLES message.
+        """
+        if target_node_id is None:
+            target_node_id = self.get_target_node_id()
+        if target_node_id is not None:
+            payload = Message.uint16array_to_bytes([target_node_id])
+            msg = Message(Message.ID_GET_CHANGED_VARIABLES, self.node_id, payload)
+            self.send(msg)
+
     def set_variables(self, chunk_offset, chunk, target_node_id=None):
         """Send a SET_VARIABLES message.
         """
@@ -520,32 +877,147 @@ class Thymio:
             for key in self.remote_node.var_offset.keys()
         ]
 
-    def get_var(self, name, index=0):
-        """Get the value of a scalar variable from the local copy.
+    def get_var(self, name, index=0, signed=False):
+        """Get the value of a scalar variable from the local copy, as int16 if signed.
         """
         with self.input_lock:
-            return self.remote_node.get_var(name, index)
+            return self.remote_node.get_var(name, index, signed)
 
-    def get_var_array(self, name):
-        """Get the value of an array variable from the local copy.
+    def get_var_array(self, name, signed=False):
+        """Get the value of an array variable from the local copy, as int16 if signed.
         """
         with self.input_lock:
-            return self.remote_node.get_var_array(name)
+            return self.remote_node.get_var_array(name, signed)
+
+    def var_view(self, name, signed=False):
+        """Get a live memoryview of a variable in the local copy, without copy.
+
+        Reading it in a loop allocates nothing; it is updated by the input thread.
+        Take it after the handshake, once the node description has fixed the
+        size of the variable space: earlier views may be released.
+        """
+        with self.input_lock:
+            return self.remote_node.var_view(name, signed)
+
+    @staticmethod
+    def word_runs(writes):
+        """Group {offset: word} writes into (offset, words) runs of adjacent offsets.
+        """
+        runs = []
+        for offset in sorted(writes):
+            if runs and offset == runs[-1][0] + len(runs[-1][1]):
+                runs[-1][1].append(writes[offset])
+            else:
+                runs.append((offset, [writes[offset]]))
+        return runs
+
+    def send_writes(self, writes):
+        """Send {offset: word} writes with one SET_VARIABLES message per run of adjacent offsets.
+        """
+        for offset, words in self.word_runs(writes):
+            self.set_variables(offset, words)
+
+    def write_words(self, writes):
+        # into the batch of the thread, the outgoing queue, or sent right away
+        batch = getattr(self.batch_local, "writes", None)
+        if batch is not None:
+            batch.update(writes)
+        elif self.write_queue:
+            with self.write_cond:
+                self.dropped_writes += sum(1 for offset in writes if offset in self.queued_writes)
+                self.queued_writes.update(writes)
+                self.write_cond.notify_all()
+        else:
+            self.send_writes(writes)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager which collects the set_var and set_var_array calls of the thread.
+
+        The writes are sent at the end, merged into as few SET_VARIABLES
+        messages as possible (e.g. both motor targets in one), and not sent at
+        all if an exception is raised. Nested batches join the outer one.
+        """
+        if getattr(self.batch_local, "writes", None) is not None:
+            yield
+            return
+        self.batch_local.writes = {}
+        try:
+            yield
+        finally:
+            writes = self.batch_local.writes
+            self.batch_local.writes = None
+        if writes:
+            self.write_words(writes)
+
+    def set_write_queue(self, enabled=True):
+        """Send the writes from a background thread, where the latest value wins.
+
+        Writes made while the link is busy are merged, and a value still
+        waiting to be sent is replaced by a newer one for the same variable
+        (counted in dropped_writes), so stale motor commands are not sent.
+        """
+        with self.write_cond:
+            self.write_queue = enabled
+            if enabled and self.write_thread is None:
+                self.write_thread = threading.Thread(target=self.do_write, daemon=True)
+                self.write_thread.start()
+        if not enabled:
+            self.flush()
+
+    def do_write(self):
+        """Writing thread code.
+        """
+        while True:
+            with self.write_cond:
+                self.write_cond.wait_for(lambda: self.queued_writes or self.terminating)
+                if not self.queued_writes:
+                    return
+                writes = self.queued_writes
+                self.queued_writes = {}
+                self.sending_writes = True
+            try:
+                self.send_writes(writes)
+            except (OSError, ValueError) as error:
+                # connection closed
+                print(error)
+            finally:
+                with self.write_cond:
+                    self.sending_writes = False
+                    self.write_cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until the queued writes are sent, return False on timeout.
+        """
+        with self.write_cond:
+            return self.write_cond.wait_for(lambda: not self.queued_writes and not self.sending_writes,
+                                            timeout)
 
     def set_var(self, name, val, index=0):
         """Set the value of a scalar variable in the local copy and send it.
         """
         with self.input_lock:
             self.remote_node.set_var(name, val, index)
-        self.set_variables(self.remote_node.var_offset[name] + index,
-                           [val])
+            offset = self.remote_node.var_offset[name] + index
+        self.write_words({offset: val & 0xffff})
 
     def set_var_array(self, name, val):
         """Set the value of an array variable in the local copy and send it.
         """
         with self.input_lock:
             self.remote_node.set_var_array(name, val)
-        self.set_variables(self.remote_node.var_offset[name], val)
+            offset = self.remote_node.var_offset[name]
+        self.write_words({offset + i: word & 0xffff for i, word in enumerate(val)})
+
+    def set_vars(self, values):
+        """Set several variables at once, {name: value or list of values}, in one batch.
+        """
+        with self.batch():
+            for name, val in values.items():
+                if isinstance(val, list):
+                    self.set_var_array(name, val)
+                else:
+                    self.set_var(name, val)
 
     def __getitem__(self, key):
         val = self.get_var_array(key)
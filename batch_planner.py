@@ -0,0 +1,106 @@
+# Many planning queries on one occupancy grid over a process pool
+# The grid lives in shared memory, tasks only carry the start and goal (needs Python >= 3.8)
+#
+#   with BatchPlanner(grid_array_output) as batch:
+#       for i, path, control_guide in batch.plan([(start_1, goal), (start_2, goal), ...]):
+#           ...  # results come in completion order, i is the index of the query
+#       batch.update(new_grid)  # same shape: written in place, the pool is kept
+
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import planner
+
+# worker side: view of the shared grid and planner, set by init_worker
+worker_shm = None
+worker_grid = None
+worker_planner = None
+
+
+def init_worker(name, shape, plan):
+    global worker_shm, worker_grid, worker_planner
+    worker_shm = shared_memory.SharedMemory(name=name)
+    worker_grid = np.ndarray(shape, np.uint8, worker_shm.buf)
+    worker_grid.flags.writeable = False
+    worker_planner = plan
+
+
+def run_query(task):
+    index, start, goal = task
+    Height, Len = worker_grid.shape
+    try:
+        path, control_guide = worker_planner(start, goal, worker_grid, Height, Len)
+    except Exception as e:
+        # start or goal outside the map or occupied: same result as an unreachable goal
+        print(e)
+        path, control_guide = [], []
+    return index, path, control_guide
+
+
+class BatchPlanner:
+    """Pool of planning processes sharing one occupancy grid.
+
+    `plan` takes many (start, goal) pairs and yields (index, path, control_guide)
+    as the queries finish. The planner has the A_Star_4_direction interface and
+    has to be picklable (a module-level function such as planner.JPS_4_direction).
+    """
+
+    def __init__(self, occupancy_grid, processes=None, plan=planner.A_Star_4_direction):
+        occupancy_grid = np.asarray(occupancy_grid)
+        self.processes = processes
+        self.planner = plan
+        self.shm = None
+        self.pool = None
+        self.start_pool(occupancy_grid.shape)
+        self.update(occupancy_grid)
+
+    def start_pool(self, shape):
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, shape[0] * shape[1]))
+        self.grid = np.ndarray(shape, np.uint8, self.shm.buf)
+        self.pool = multiprocessing.Pool(self.processes, init_worker, (self.shm.name, shape, self.planner))
+
+    def stop_pool(self):
+        self.pool.close()
+        self.pool.join()
+        self.grid = None
+        self.shm.close()
+        self.shm.unlink()
+
+    def update(self, occupancy_grid):
+        """Set a new map, only between batches.
+
+        A grid of the same shape is written in place; another shape restarts the pool.
+        """
+        occupancy_grid = np.asarray(occupancy_grid)
+        if occupancy_grid.shape != self.grid.shape:
+            self.stop_pool()
+            self.start_pool(occupancy_grid.shape)
+        np.copyto(self.grid, occupancy_grid != 0)
+
+    def plan(self, queries, chunksize=1):
+        """Plan every (start, goal) pair, yield (index, path, control_guide) in completion order.
+        """
+        tasks = [(i, (int(start[0]), int(start[1])), (int(goal[0]), int(goal[1])))
+                 for i, (start, goal) in enumerate(queries)]
+        return self.pool.imap_unordered(run_query, tasks, chunksize)
+
+    def plan_all(self, queries, chunksize=1):
+        """Plan every (start, goal) pair, return the (path, control_guide) list in query order.
+        """
+        results = [None] * len(queries)
+        for i, path, control_guide in self.plan(queries, chunksize):
+            results[i] = (path, control_guide)
+        return results
+
+    def close(self):
+        """Stop the workers and free the shared grid.
+        """
+        if self.pool is not None:
+            self.stop_pool()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
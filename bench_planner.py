@@ -0,0 +1,225 @@
+# Benchmark of the planners of planner.py on seeded maps
+# Usage:
+#   python bench_planner.py
+#   python bench_planner.py --engines astar4,jps4,hpa4 --sizes 56x80,140x200
+#   python bench_planner.py --save-baseline planner_baseline.json
+#   python bench_planner.py --baseline planner_baseline.json
+
+import argparse
+import json
+import math
+import sys
+import time
+import tracemalloc
+import numpy as np
+import cv2
+import vision_func
+import planner
+
+def random_map(height, width, density, seed=0):
+    # uniform random obstacles, like the notebook demo (threshold 12 on rand*20 is density 0.4)
+    rng = np.random.RandomState(seed)
+    return (rng.rand(height, width) < density).astype(np.uint8)
+
+def notebook_map():
+    # the random map of the notebook with its start and goal
+    np.random.seed(0)
+    generate_eg = np.random.rand(50, 30) * 20
+    return (generate_eg > 12).astype(np.uint8), (1, 2), (42, 28)
+
+def maze_map(height, width, seed=0):
+    # perfect maze carved by a randomized depth-first search, walls are one cell thick
+    rng = np.random.RandomState(seed)
+    grid = np.ones((height, width), np.uint8)
+    grid[0, 0] = 0
+    stack = [(0, 0)]
+    while stack:
+        r, c = stack[-1]
+        moves = [(dr, dc) for dr, dc in ((2, 0), (0, 2), (-2, 0), (0, -2))
+                 if 0 <= r + dr < height and 0 <= c + dc < width and grid[r + dr, c + dc]]
+        if not moves:
+            stack.pop()
+            continue
+        dr, dc = moves[rng.randint(len(moves))]
+        grid[r + dr // 2, c + dc // 2] = 0
+        grid[r + dr, c + dc] = 0
+        stack.append((r + dr, c + dc))
+    return grid
+
+def arena_map(grid_size, seed=0, real_width=80, real_height=56):
+    # occupancy grid of a synthetic arena as produced by the vision chain
+    mask = np.zeros((480, 640), np.uint8)
+    rng = np.random.RandomState(seed)
+    for _ in range(6):
+        y, x = rng.randint(40, 400), rng.randint(40, 560)
+        mask[y:y + rng.randint(15, 60), x:x + rng.randint(15, 60)] = 255
+    dilated = vision_func.dilate_obstacle(mask, 42)
+    grid = vision_func.rasterize(dilated, real_width, real_height, grid_size, (0, 0), (0, 0))[1]
+    return grid.astype(np.uint8)
+
+def pick_query(grid, seed=0):
+    # start in the largest free region, goal among the farthest quarter of the cells reachable from it
+    rng = np.random.RandomState(seed)
+    n, labels = cv2.connectedComponents((grid == 0).astype(np.uint8), connectivity=4)
+    largest = 1 + np.argmax(np.bincount(labels[grid == 0].ravel(), minlength=n)[1:])
+    free = np.argwhere(labels == largest)
+    start = tuple(int(v) for v in free[rng.randint(len(free))])
+    dist = planner.goal_distance_field(grid, start)
+    reachable = np.argwhere(np.isfinite(dist))
+    far = reachable[dist[tuple(reachable.T)] >= np.percentile(dist[tuple(reachable.T)], 75)]
+    goal = tuple(int(v) for v in far[rng.randint(len(far))])
+    return start, goal
+
+def make_maps(sizes, densities, seed=0):
+    """List of (name, grid, start, goal) of the suite.
+    """
+    maps = []
+    grid, start, goal = notebook_map()
+    if not grid[start] and not grid[goal]:
+        maps.append(("notebook", grid, start, goal))
+    for height, width in sizes:
+        for density in densities:
+            grid = random_map(height, width, density, seed)
+            maps.append((f"random{height}x{width}d{density}", grid) + pick_query(grid, seed))
+        grid = maze_map(height, width, seed)
+        maps.append((f"maze{height}x{width}", grid) + pick_query(grid, seed))
+    for grid_size in (4, 2, 1):
+        grid = arena_map(grid_size, seed)
+        maps.append((f"arena{grid_size}cm", grid) + pick_query(grid, seed))
+    return maps
+
+def run_search(fun, movements):
+    def run(prepared, start, goal, grid):
+        stats = {}
+        path, control_guide = fun(start, goal, grid, movements, stats=stats)
+        return path, control_guide, stats["expanded"]
+    return None, run
+
+def run_theta(prepared, start, goal, grid):
+    stats = {}
+    path, control_guide = planner.theta_star(start, goal, grid, stats=stats)
+    return path, control_guide, stats["expanded"]
+
+def run_dstar(prepared, start, goal, grid):
+    dstar = planner.DStarLite(grid, goal)
+    path, control_guide = dstar.replan(start)
+    return path, control_guide, dstar.expanded
+
+def prepare_field(grid, goal):
+    field = planner.GoalField(goal)
+    field.update(grid)
+    return field
+
+def run_field(field, start, goal, grid):
+    path, control_guide = field.path(start)
+    return path, control_guide, None
+
+def run_hpa(hpa, start, goal, grid):
+    path, control_guide = hpa.plan(start, goal)
+    return path, control_guide, hpa.expanded
+
+# name: (prepare(grid, goal) or None, run(prepared, start, goal, grid))
+engines = {
+    "astar4": run_search(planner.astar, planner.movements_4),
+    "astar8": run_search(planner.astar, planner.movements_8),
+    "jps4": run_search(planner.jump_point_search, planner.movements_4),
+    "jps8": run_search(planner.jump_point_search, planner.movements_8),
+    "theta": (None, run_theta),
+    "dstar4": (None, run_dstar),
+    "field4": (prepare_field, run_field),
+    "hpa4": (lambda grid, goal: planner.HierarchicalPlanner(grid, 10, planner.movements_4), run_hpa),
+    "hpa8": (lambda grid, goal: planner.HierarchicalPlanner(grid, 10, planner.movements_8), run_hpa),
+}
+
+def path_cost(control_guide):
+    return sum(math.hypot(dr, dc) for dr, dc in control_guide)
+
+def bench_engine(name, grid, start, goal, repeat=3, memory=True):
+    """Time one engine on one query, return its statistics (times in ms, memory in kB).
+    """
+    prepare, run = engines[name]
+    prep_times, query_times = [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        prepared = prepare(grid, goal) if prepare else None
+        t1 = time.perf_counter()
+        path, control_guide, expanded = run(prepared, start, goal, grid)
+        t2 = time.perf_counter()
+        prep_times.append(t1 - t0)
+        query_times.append(t2 - t1)
+    result = {"prep_ms": min(prep_times) * 1e3, "query_ms": min(query_times) * 1e3,
+              "expanded": expanded, "cost": path_cost(control_guide) if path else None}
+    if memory:
+        # separate run, tracing slows the code down
+        tracemalloc.start()
+        prepared = prepare(grid, goal) if prepare else None
+        run(prepared, start, goal, grid)
+        result["peak_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    return result
+
+def bench_planners(maps, engine_names, repeat=3, memory=True):
+    results = {}
+    print(f"{'map':>22} {'cells':>7} {'engine':>7} {'prep (ms)':>10} {'query (ms)':>11} {'expanded':>9} {'cost':>8} {'peak (kB)':>10}")
+    for map_name, grid, start, goal in maps:
+        for name in engine_names:
+            result = bench_engine(name, grid, start, goal, repeat, memory)
+            results[f"{map_name}/{name}"] = result
+            expanded = "-" if result["expanded"] is None else result["expanded"]
+            cost = "-" if result["cost"] is None else f"{result['cost']:.2f}"
+            print(f"{map_name:>22} {grid.size:>7} {name:>7} {result['prep_ms']:>10.2f} {result['query_ms']:>11.2f} "
+                  f"{expanded:>9} {cost:>8} {result.get('peak_kb', float('nan')):>10.1f}")
+    return results
+
+def check_regression(results, baseline, tolerance=0.2, min_ms=1.0):
+    """Compare the times and path costs with a baseline, return the list of regressions.
+
+    Times under min_ms are too noisy to compare.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+        for field in ("prep_ms", "query_ms"):
+            limit = max(reference[field], min_ms) * (1 + tolerance)
+            if result[field] > limit:
+                regressions.append(f"{key}: {field} {result[field]:.2f} > {limit:.2f}")
+        if reference["cost"] is not None and (result["cost"] is None or result["cost"] > reference["cost"] + 1e-6):
+            regressions.append(f"{key}: path cost {result['cost']} > {reference['cost']:.2f}")
+    return regressions
+
+def parse_size(text):
+    height, width = text.lower().split("x")
+    return int(height), int(width)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the planners on seeded maps")
+    parser.add_argument("--engines", default=",".join(engines),
+                        help="comma separated engines among " + ", ".join(engines))
+    parser.add_argument("--sizes", default="14x20,56x80,140x200", help="comma separated HEIGHTxWIDTH")
+    parser.add_argument("--densities", default="0.1,0.25,0.4", help="comma separated obstacle densities")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--baseline", help="fail if slower than this baseline or with a worse path")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--save-baseline", help="store the results as baseline")
+    args = parser.parse_args()
+
+    engine_names = args.engines.split(",")
+    for name in engine_names:
+        if name not in engines:
+            parser.error(f"unknown engine {name}")
+    maps = make_maps([parse_size(s) for s in args.sizes.split(",")],
+                     [float(d) for d in args.densities.split(",")], args.seed)
+    results = bench_planners(maps, engine_names, args.repeat, not args.no_memory)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = check_regression(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("regression", regression)
+        sys.exit(1 if regressions else 0)
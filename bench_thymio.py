@@ -0,0 +1,137 @@
+# Micro-benchmark of the Thymio communication code without robot
+# Usage:
+#   python bench_thymio.py message
+#   python bench_thymio.py message --sizes 10,100,600
+#   python bench_thymio.py parser
+
+import argparse
+import io
+import time
+import numpy as np
+from Thymio import Message, InputThread
+
+def decode_variables_loop(payload):
+    # former ID_VARIABLES decoding, one word at a time, kept for comparison
+    msg = Message(Message.ID_VARIABLES, 1, payload)
+    def get_uint16(offset):
+        return msg.payload[offset] + 256 * msg.payload[offset + 1], offset + 2
+    var_offset, offset = get_uint16(0)
+    var_data = []
+    for i in range(len(payload) // 2 - 1):
+        word, offset = get_uint16(offset)
+        var_data.append(word)
+    return var_offset, var_data
+
+def uint16array_to_bytes_loop(a):
+    # former encoding with repeated bytes concatenation, kept for comparison
+    b = b""
+    for word in a:
+        b += bytes([word % 256, word // 256])
+    return b
+
+def serialize_loop(msg):
+    return (uint16array_to_bytes_loop([len(msg.payload)]) + uint16array_to_bytes_loop([msg.source_node]) +
+            uint16array_to_bytes_loop([msg.id]) + msg.payload)
+
+def decode_variables(payload):
+    msg = Message(Message.ID_VARIABLES, 1, payload)
+    msg.decode()
+    return msg.var_offset, msg.var_data
+
+class CountingIO(io.RawIOBase):
+    # in-memory stream which counts its read calls, like the syscalls of a serial port
+    def __init__(self, data, chunk=4096):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.chunk = chunk
+        self.reads = 0
+    def readable(self):
+        return True
+    def readinto(self, b):
+        self.reads += 1
+        n = min(len(b), self.chunk, len(self.data) - self.pos)
+        b[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+def read_messages_loop(stream):
+    # former InputThread.read_message: three 2-byte reads and a payload read per message
+    messages = []
+    while True:
+        try:
+            b = stream.read(2)
+            payload_len = b[0] + 256 * b[1]
+            b = stream.read(2)
+            source_node = b[0] + 256 * b[1]
+            b = stream.read(2)
+            id = b[0] + 256 * b[1]
+            payload = stream.read(payload_len)
+        except IndexError:
+            return messages
+        messages.append(Message(id, source_node, payload))
+
+def read_messages_buffered(stream):
+    thread = InputThread(stream)
+    return list(iter(thread.read_message, None))
+
+def time_call(fun, *args, repeat=2000):
+    # best of 5 runs of `repeat` calls, in microseconds per call
+    best = np.inf
+    for _ in range(5):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fun(*args)
+        best = min(best, (time.perf_counter() - t0) / repeat)
+    return best * 1e6
+
+def bench_message(sizes=(10, 100, 600)):
+    rng = np.random.RandomState(0)
+    print(f"{'words':>6} {'operation':>10} {'loop (us)':>10} {'struct (us)':>12} {'speedup':>8}")
+    for size in sizes:
+        words = [int(w) for w in rng.randint(0, 65536, size)]
+        payload = uint16array_to_bytes_loop([0] + words)
+        ref = decode_variables_loop(payload)
+        new = decode_variables(payload)
+        assert ref[0] == new[0] and list(ref[1]) == list(new[1])
+        assert uint16array_to_bytes_loop(words) == Message.uint16array_to_bytes(words)
+        msg = Message(Message.ID_SET_VARIABLES, 1, payload)
+        assert serialize_loop(msg) == msg.serialize()
+        repeat = max(20, 20000 // size)
+        for name, loop, fast, args in [("decode", decode_variables_loop, decode_variables, (payload,)),
+                                       ("encode", uint16array_to_bytes_loop, Message.uint16array_to_bytes, (words,)),
+                                       ("serialize", serialize_loop, Message.serialize, (msg,))]:
+            t_loop = time_call(loop, *args, repeat=repeat)
+            t_fast = time_call(fast, *args, repeat=repeat)
+            print(f"{size:>6} {name:>10} {t_loop:>10.2f} {t_fast:>12.2f} {t_loop/t_fast:>7.1f}x")
+
+def bench_parser(n_messages=2000, words=(3, 16, 120)):
+    # refresh traffic: mostly short sensor reads, some full variable blocks
+    rng = np.random.RandomState(0)
+    msgs = [Message(Message.ID_VARIABLES, 1, Message.uint16array_to_bytes([0] + [int(w) for w in rng.randint(0, 65536, words[i % len(words)])]))
+            for i in range(n_messages)]
+    data = b"".join(msg.serialize() for msg in msgs)
+    print(f"{'reader':>9} {'messages':>9} {'reads':>7} {'reads/msg':>10} {'time (ms)':>10}")
+    for name, reader in [("loop", read_messages_loop), ("buffered", read_messages_buffered)]:
+        best = np.inf
+        for _ in range(5):
+            stream = CountingIO(data)
+            t0 = time.perf_counter()
+            out = reader(stream)
+            best = min(best, time.perf_counter() - t0)
+        assert [m.payload for m in out] == [m.payload for m in msgs]
+        print(f"{name:>9} {len(out):>9} {stream.reads:>7} {stream.reads/len(out):>10.3f} {best*1e3:>10.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the Thymio communication code")
+    subparsers = parser.add_subparsers(dest="command")
+    message_parser = subparsers.add_parser("message", help="Message decoding and encoding against the former loops")
+    message_parser.add_argument("--sizes", default="10,100,600", help="comma separated numbers of words")
+    subparsers.add_parser("parser", help="reads per message of the buffered frame parser against the former reader")
+    args = parser.parse_args()
+
+    if args.command == "message":
+        bench_message([int(s) for s in args.sizes.split(",")])
+    elif args.command == "parser":
+        bench_parser()
+    else:
+        bench_message()
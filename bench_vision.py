@@ -0,0 +1,300 @@
+# Benchmark of the vision functions without camera
+# Usage:
+#   python bench_vision.py rasterize
+#   python bench_vision.py pyramid
+#   python bench_vision.py pipeline --synthetic 200
+#   python bench_vision.py pipeline --frames recorded_dir --processes 4
+#   python bench_vision.py pipeline --synthetic 200 --save-baseline baseline.json
+#   python bench_vision.py pipeline --synthetic 200 --baseline baseline.json
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+import cv2
+import vision_func
+
+# same settings as the notebook
+offset_thymio = (9, 25)
+ext_pixels = 42
+grid_size = 4
+real_height = 56
+real_width = 80
+
+def rasterize_loop(obstacles_mask_dilated,real_width,real_height,grid_size,start_point,end_point):
+    # reference implementation with one np.sum per cell, kept for comparison
+    grid_output = obstacles_mask_dilated.copy()
+    rows,cols = grid_output.shape
+    grid_size_h = rows*grid_size/real_height
+    grid_size_w = cols*grid_size/real_width
+    grid_array_output = np.zeros([int(real_height/grid_size),int(real_width/grid_size)])
+    grid_array_start = (int(start_point[0]//grid_size_h),int(start_point[1]//grid_size_w))
+    grid_array_end = (int(end_point[0]//grid_size_h),int(end_point[1]//grid_size_w))
+    for i in range(0,int(real_height/grid_size)):
+        for j in range(0, int(real_width/grid_size)):
+            sum = np.sum(grid_output[int(i*grid_size_h):int((i+1)*grid_size_h),int(j*grid_size_w):int((j+1)*grid_size_w)])
+            if (sum >= 255 ):
+                grid_output[int(i*grid_size_h):int((i+1)*grid_size_h),int(j*grid_size_w):int((j+1)*grid_size_w)] = 255
+                grid_array_output[i,j] = 1;
+            else:
+                grid_output[int(i*grid_size_h):int((i+1)*grid_size_h),int(j*grid_size_w):int((j+1)*grid_size_w)] = 0
+    return(grid_output,grid_array_output,grid_array_start,grid_array_end)
+
+def synthetic_dilated_mask(rows=480, cols=640, n_obstacles=6, ext_pixels=42, seed=0):
+    # random rectangles dilated like vision_func.dilate_obstacle, walls included
+    rng = np.random.RandomState(seed)
+    mask = np.zeros((rows,cols), np.uint8)
+    for _ in range(n_obstacles):
+        y, x = rng.randint(0, rows-40), rng.randint(0, cols-40)
+        h, w = rng.randint(15, 60), rng.randint(15, 60)
+        mask[y:y+h,x:x+w] = 255
+    return vision_func.dilate_obstacle(mask, ext_pixels)
+
+def hsv_color(lower, upper):
+    # color in the middle of HSV bounds, as a pixel of the RGB frames fed to the vision functions
+    hsv = ((np.asarray(lower) + np.asarray(upper)) // 2).astype(np.uint8)
+    return cv2.cvtColor(hsv.reshape(1, 1, 3), cv2.COLOR_HSV2RGB)[0, 0].tolist()
+
+def synthetic_frame(index, seed=0, n_obstacles=4, noise=4):
+    # raw camera frame of a procedurally generated arena seen in perspective;
+    # obstacles are fixed by the seed, the robot moves with the index
+    rng = np.random.RandomState(seed)
+    arena = np.full((480, 640, 3), 200, np.uint8)
+    for _ in range(n_obstacles):
+        y, x = rng.randint(60, 380), rng.randint(60, 540)
+        cv2.rectangle(arena, (x, y), (x + rng.randint(30, 80), y + rng.randint(30, 80)),
+                      hsv_color(vision_func.red_lower, vision_func.red_upper), -1)
+    cv2.circle(arena, (560, 60), 16, hsv_color(vision_func.yellow_lower, vision_func.yellow_upper), -1)
+    angle = 0.05 * index
+    cx, cy = 320 + int(200 * np.cos(angle)), 240 + int(150 * np.sin(angle))
+    dx, dy = int(15 * np.cos(angle + np.pi / 2)), int(15 * np.sin(angle + np.pi / 2))
+    cv2.circle(arena, (cx + dx, cy + dy), 10, hsv_color(vision_func.green_lower, vision_func.green_upper), -1)
+    cv2.circle(arena, (cx - dx, cy - dy), 10, hsv_color(vision_func.blue_lower, vision_func.blue_upper), -1)
+    # camera view: arena corners inside the zones where vision_func looks for the pink markers
+    corners = np.float32([[45, 40], [595, 50], [30, 430], [610, 420]])
+    transform = cv2.getPerspectiveTransform(np.float32([[0, 0], [640, 0], [0, 480], [640, 480]]), corners)
+    frame = cv2.warpPerspective(arena, transform, (640, 480), borderValue=(90, 90, 90))
+    for (x, y) in corners.astype(int):
+        cv2.circle(frame, (int(x), int(y)), 12, hsv_color(vision_func.pink_lower, vision_func.pink_upper), -1)
+    frame_rng = np.random.RandomState(seed * 100003 + index)
+    frame = np.clip(frame.astype(np.int16) + frame_rng.randint(-noise, noise + 1, frame.shape), 0, 255)
+    return frame.astype(np.uint8)
+
+def frame_files(path):
+    return sorted(f for ext in ("*.png", "*.jpg", "*.jpeg", "*.bmp") for f in glob.glob(os.path.join(path, ext)))
+
+class ReferencePipeline:
+    """transform_img -> color_mask -> dilate_obstacle -> rasterize on every frame.
+    """
+
+    stages = ["transform_img", "color_mask", "dilate_obstacle", "rasterize"]
+
+    def __call__(self, frame, timings):
+        t0 = time.perf_counter()
+        warped_img = vision_func.transform_img(frame)
+        t1 = time.perf_counter()
+        obstacles_mask, start_point, end_point, start_direction = vision_func.color_mask(warped_img, offset_thymio)
+        t2 = time.perf_counter()
+        obstacles_mask_dilated = vision_func.dilate_obstacle(obstacles_mask, ext_pixels)
+        t3 = time.perf_counter()
+        result = vision_func.rasterize(obstacles_mask_dilated, real_width, real_height, grid_size, start_point, end_point)
+        t4 = time.perf_counter()
+        timings.append((t1 - t0, t2 - t1, t3 - t2, t4 - t3))
+        return result
+
+class FastPipeline:
+    """Cached warp, marker tracking and incremental obstacle map.
+    """
+
+    stages = ["warp", "segment", "obstacle_map", "rasterize"]
+
+    def __init__(self, obstacle_every=1):
+        self.warper = vision_func.FixedCameraWarper()
+        self.tracker = vision_func.MarkerTracker(offset_thymio)
+        self.obstacle_map = vision_func.ObstacleMap(ext_pixels, real_width, real_height, grid_size)
+        self.obstacle_every = obstacle_every
+        self.count = 0
+        self.end_point = None
+
+    def __call__(self, frame, timings):
+        t0 = time.perf_counter()
+        warped_img = self.warper(frame)
+        t1 = time.perf_counter()
+        pose = None
+        if self.end_point is not None and self.count % self.obstacle_every != 0:
+            pose = self.tracker.update(warped_img)
+        if pose is None:
+            obstacles_mask, start_point, self.end_point, start_direction = vision_func.color_mask(warped_img, offset_thymio)
+            t2 = time.perf_counter()
+            self.obstacle_map.update(obstacles_mask)
+        else:
+            start_point, start_direction = pose
+            t2 = time.perf_counter()
+        t3 = time.perf_counter()
+        result = self.obstacle_map.rasterize(start_point, self.end_point)
+        t4 = time.perf_counter()
+        self.count += 1
+        timings.append((t1 - t0, t2 - t1, t3 - t2, t4 - t3))
+        return result
+
+def make_pipeline(name, obstacle_every=1):
+    if name == "reference":
+        return ReferencePipeline()
+    return FastPipeline(obstacle_every)
+
+def load_frame(files, i, seed):
+    # recorded frames are stored as BGR, the vision functions work on RGB camera frames
+    if files is None:
+        return synthetic_frame(i, seed)
+    return cv2.cvtColor(cv2.imread(files[i]), cv2.COLOR_BGR2RGB)
+
+def run_chunk(args):
+    # worker: run one pipeline over a chunk of frames, return the stage timings and the processing time;
+    # the frames are loaded or generated before, outside of the timed loop
+    pipeline_name, obstacle_every, frames_path, indices, seed = args
+    files = frame_files(frames_path) if frames_path else None
+    frames = [load_frame(files, i, seed) for i in indices]
+    pipeline = make_pipeline(pipeline_name, obstacle_every)
+    timings = []
+    t0 = time.perf_counter()
+    for frame in frames:
+        pipeline(frame, timings)
+    return timings, time.perf_counter() - t0
+
+def bench_pipeline(pipeline_name="reference", frames_path=None, n_synthetic=100, processes=1,
+                   obstacle_every=1, seed=0, warmup=3):
+    """Run a vision pipeline over recorded or synthetic frames, return latency statistics in ms.
+    """
+    n = len(frame_files(frames_path)) if frames_path else n_synthetic
+    if n == 0:
+        raise ValueError("no frame to process")
+    # no empty chunk when there are more processes than frames
+    processes = min(processes, n)
+    stages = make_pipeline(pipeline_name).stages
+    indices = list(range(n))
+    chunks = [indices[k::processes] if pipeline_name == "reference" else indices[k * n // processes:(k + 1) * n // processes]
+              for k in range(processes)]
+    tasks = [(pipeline_name, obstacle_every, frames_path, chunk, seed) for chunk in chunks]
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(run_chunk, tasks)
+    else:
+        results = [run_chunk(task) for task in tasks]
+    # warmup frames of each process are left out, but not all the frames of a short chunk
+    timings = np.array([t for chunk, _ in results for t in chunk[min(warmup, len(chunk) - 1):]]) * 1e3
+    total = timings.sum(axis=1)
+    # throughput of the processing only: frame loading and pool startup are not counted,
+    # the processes run in parallel so the slowest one sets the pace
+    busy = max(elapsed for _, elapsed in results)
+    stats = {"pipeline": pipeline_name, "frames": n, "processes": processes, "fps": n / busy}
+    for name, column in zip(stages + ["total"], list(timings.T) + [total]):
+        stats[name] = {p: float(np.percentile(column, int(p[1:]))) for p in ("p50", "p90", "p99")}
+    return stats
+
+def print_stats(stats):
+    print(f"{stats['pipeline']} pipeline, {stats['frames']} frames, {stats['processes']} process(es): {stats['fps']:.1f} fps")
+    print(f"{'stage':>16} {'p50 (ms)':>9} {'p90 (ms)':>9} {'p99 (ms)':>9}")
+    for name, value in stats.items():
+        if isinstance(value, dict):
+            print(f"{name:>16} {value['p50']:>9.2f} {value['p90']:>9.2f} {value['p99']:>9.2f}")
+
+def check_regression(stats, baseline, tolerance=0.2):
+    """Compare the p50 of every stage with a baseline, return the list of regressions.
+    """
+    regressions = []
+    for name, value in stats.items():
+        if isinstance(value, dict) and name in baseline:
+            limit = baseline[name]["p50"] * (1 + tolerance)
+            if value["p50"] > limit:
+                regressions.append(f"{name}: p50 {value['p50']:.2f} ms > {limit:.2f} ms")
+    return regressions
+
+def bench_pyramid(n_frames=50, scales=(1, 2, 4), seed=0):
+    """Accuracy against full resolution color_mask and latency of color_mask_pyramid.
+    """
+    warper = vision_func.FixedCameraWarper()
+    warped = [warper(synthetic_frame(i, seed)) for i in range(n_frames)]
+    reference = [vision_func.color_mask(img, offset_thymio) for img in warped]
+    grid = (real_width, real_height, grid_size)
+    print(f"{'scale':>5} {'refine':>7} {'p50 (ms)':>9} {'pose err (px)':>14} {'max err':>8} {'cell err':>9} {'obst IoU':>9}")
+    for scale in scales:
+        for refine in ([False, "grid", True] if scale > 1 else [False]):
+            timings, errors, cell_errors, ious = [], [], 0, []
+            for img, ref in zip(warped, reference):
+                t0 = time.perf_counter()
+                out = vision_func.color_mask_pyramid(img, offset_thymio, scale, refine=bool(refine),
+                                                     grid=grid if refine == "grid" else None)
+                timings.append(time.perf_counter() - t0)
+                errors.append(np.hypot(out[1][0] - ref[1][0], out[1][1] - ref[1][1]))
+                rows, cols = img.shape[:2]
+                cell = lambda p: (int(p[0] // (rows * grid_size / real_height)), int(p[1] // (cols * grid_size / real_width)))
+                cell_errors += cell(out[1]) != cell(ref[1])
+                inter = np.count_nonzero(cv2.bitwise_and(out[0], ref[0]))
+                union = np.count_nonzero(cv2.bitwise_or(out[0], ref[0]))
+                ious.append(inter / union if union else 1.0)
+            print(f"{scale:>5} {str(refine):>7} {np.percentile(timings, 50)*1e3:>9.2f} {np.mean(errors):>14.2f} "
+                  f"{np.max(errors):>8.2f} {cell_errors/n_frames:>9.2%} {np.mean(ious):>9.3f}")
+
+def time_call(fun, *args, repeat=20):
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fun(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def bench_rasterize(grid_sizes=(8, 4, 2, 1, 0.5), real_width=80, real_height=56):
+    mask = synthetic_dilated_mask()
+    start_point, end_point = (240, 100), (100, 500)
+    print(f"{'grid (cm)':>10} {'cells':>8} {'loop (ms)':>10} {'vector (ms)':>12} {'speedup':>8}")
+    for grid_size in grid_sizes:
+        args = (mask, real_width, real_height, grid_size, start_point, end_point)
+        ref = rasterize_loop(*args)
+        new = vision_func.rasterize(*args)
+        assert np.array_equal(ref[0], new[0]) and np.array_equal(ref[1], new[1])
+        assert ref[2:] == new[2:]
+        repeat = 3 if grid_size < 2 else 10
+        t_loop = time_call(rasterize_loop, *args, repeat=repeat)
+        t_vec = time_call(vision_func.rasterize, *args, repeat=repeat)
+        cells = new[1].size
+        print(f"{grid_size:>10} {cells:>8} {t_loop*1e3:>10.2f} {t_vec*1e3:>12.2f} {t_loop/t_vec:>7.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the vision functions")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("rasterize", help="compare rasterize with the former per-cell loop")
+    subparsers.add_parser("pyramid", help="accuracy and latency of the multi-resolution color_mask")
+    pipeline_parser = subparsers.add_parser("pipeline", help="time the whole vision chain")
+    pipeline_parser.add_argument("--pipeline", choices=["reference", "fast"], default="reference")
+    pipeline_parser.add_argument("--frames", help="directory of recorded raw frames")
+    pipeline_parser.add_argument("--synthetic", type=int, default=100, help="number of synthetic frames")
+    pipeline_parser.add_argument("--seed", type=int, default=0)
+    pipeline_parser.add_argument("--processes", type=int, default=1)
+    pipeline_parser.add_argument("--obstacle-every", type=int, default=1,
+                                 help="fast pipeline: run the obstacle map every n frames")
+    pipeline_parser.add_argument("--baseline", help="fail if slower than this baseline")
+    pipeline_parser.add_argument("--tolerance", type=float, default=0.2)
+    pipeline_parser.add_argument("--save-baseline", help="store the results as baseline")
+    args = parser.parse_args()
+
+    if args.command == "pipeline":
+        stats = bench_pipeline(args.pipeline, args.frames, args.synthetic, args.processes,
+                               args.obstacle_every, args.seed)
+        print_stats(stats)
+        if args.save_baseline:
+            with open(args.save_baseline, "w") as f:
+                json.dump(stats, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = check_regression(stats, json.load(f), args.tolerance)
+            for regression in regressions:
+                print("regression", regression)
+            sys.exit(1 if regressions else 0)
+    elif args.command == "pyramid":
+        bench_pyramid()
+    else:
+        bench_rasterize()
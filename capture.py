@@ -0,0 +1,160 @@
+# Threaded webcam capture feeding the vision functions
+
+import collections
+import threading
+import time
+
+
+class FrameGrabber(threading.Thread):
+    """Thread which reads frames continuously and keeps only the newest ones.
+
+    Frames are stored as (frame_id, timestamp, frame) in a bounded buffer;
+    older frames that were never consumed are counted in `dropped`.
+    """
+
+    def __init__(self, cap, buffer_size=1):
+        threading.Thread.__init__(self, daemon=True)
+        self.cap = cap
+        self.buffer = collections.deque(maxlen=buffer_size)
+        self.cond = threading.Condition()
+        self.terminating = False
+        self.frame_count = 0
+        self.dropped = 0
+        self.failed_reads = 0
+        self.last_read_id = -1
+
+    @staticmethod
+    def camera(index=0, buffer_size=1):
+        """Create a FrameGrabber on a cv2.VideoCapture device.
+        """
+        import cv2
+        cap = cv2.VideoCapture(index)
+        # keep the driver queue short too, stale frames are what we want to avoid
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return FrameGrabber(cap, buffer_size)
+
+    def run(self):
+        """Grabber thread code.
+        """
+        while not self.terminating:
+            ret, frame = self.cap.read()
+            timestamp = time.monotonic()
+            if not ret:
+                self.failed_reads += 1
+                time.sleep(0.01)
+                continue
+            with self.cond:
+                if len(self.buffer) == self.buffer.maxlen and self.buffer[0][0] > self.last_read_id:
+                    self.dropped += 1
+                self.buffer.append((self.frame_count, timestamp, frame))
+                self.frame_count += 1
+                self.cond.notify_all()
+
+    def latest(self, timeout=None):
+        """Wait for a frame newer than the last one returned and return (frame_id, timestamp, frame).
+
+        Return None on timeout.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.buffer and self.buffer[-1][0] > self.last_read_id,
+                                      timeout):
+                return None
+            item = self.buffer[-1]
+            # frames between the previous read and this one are skipped
+            self.dropped += sum(1 for (frame_id, _, _) in self.buffer
+                                if self.last_read_id < frame_id < item[0])
+            self.last_read_id = item[0]
+            return item
+
+    def stop(self):
+        """Stop the thread and release the camera.
+        """
+        self.terminating = True
+        self.join()
+        self.cap.release()
+
+
+class FrameProcessor(threading.Thread):
+    """Thread which runs `process(frame)` on the newest frame of a FrameGrabber.
+
+    The last result is available with its frame timestamp from `latest_result()`.
+    """
+
+    def __init__(self, grabber, process):
+        threading.Thread.__init__(self, daemon=True)
+        self.grabber = grabber
+        self.process = process
+        self.lock = threading.Lock()
+        self.terminating = False
+        self.result = None
+        self.result_frame_id = None
+        self.result_timestamp = None
+        self.processed = 0
+        self.errors = 0
+        self.processing_time = 0.0
+
+    def run(self):
+        """Processing thread code.
+        """
+        while not self.terminating:
+            item = self.grabber.latest(timeout=0.5)
+            if item is None:
+                continue
+            frame_id, timestamp, frame = item
+            t0 = time.monotonic()
+            try:
+                result = self.process(frame)
+            except Exception as e:
+                self.errors += 1
+                print(e)
+                continue
+            with self.lock:
+                self.result = result
+                self.result_frame_id = frame_id
+                self.result_timestamp = timestamp
+                self.processed += 1
+                self.processing_time = time.monotonic() - t0
+
+    def latest_result(self):
+        """Get (result, frame_timestamp, age in s) of the last processed frame.
+        """
+        with self.lock:
+            if self.result_timestamp is None:
+                return None, None, None
+            return self.result, self.result_timestamp, time.monotonic() - self.result_timestamp
+
+    def stats(self):
+        """Get the capture and processing counters.
+        """
+        with self.lock:
+            return {
+                "grabbed": self.grabber.frame_count,
+                "dropped": self.grabber.dropped,
+                "failed_reads": self.grabber.failed_reads,
+                "processed": self.processed,
+                "errors": self.errors,
+                "processing_time": self.processing_time,
+            }
+
+    def stop(self):
+        """Stop the thread.
+        """
+        self.terminating = True
+        self.join()
+
+
+if __name__ == "__main__":
+    import vision_func
+    grabber = FrameGrabber.camera(1)
+    warper = vision_func.FixedCameraWarper()
+    processor = FrameProcessor(grabber, warper)
+    grabber.start()
+    processor.start()
+    try:
+        while True:
+            time.sleep(1)
+            result, timestamp, age = processor.latest_result()
+            print(f"pose age {age} s", processor.stats())
+    except KeyboardInterrupt:
+        processor.stop()
+        grabber.stop()
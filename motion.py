@@ -0,0 +1,104 @@
+# Global controller driving the Thymio along the segments of planner.motion_program
+# Same motion primitives and settings as the notebook, but a run of identical
+# moves is one continuous drive instead of a stop-and-go per cell
+#
+#   path, control_guide = planner.A_Star_4_direction(start, goal, globalmap, h, w)
+#   program = planner.motion_program(control_guide)
+#   th.set_write_queue(True)  # optional: stale motor commands are dropped on a slow link
+#   controller = MotionController(th)
+#   for segment in program:
+#       steps = controller.execute_segment(segment, curr_ang, should_stop=obstacle_ahead)
+#       curr_ang = segment.heading
+
+import math
+import time
+
+
+def regulate_angle(ang):
+    """Wrap an angle to [-pi, pi].
+    """
+    return (ang + math.pi) % (2 * math.pi) - math.pi
+
+
+class MotionController:
+    """Motor commands of the global navigation.
+
+    Durations are open loop, as in the notebook: forward_duration seconds per
+    cell and rot_duration seconds per radian.
+    """
+
+    def __init__(self, th, run_speed=118, rot_speed=125, forward_duration=1, rot_duration=1.2,
+                 lw_offset=0, rw_offset=0, err_orient=math.pi/36, poll_interval=0.05):
+        self.th = th
+        self.run_speed = run_speed
+        self.rot_speed = rot_speed
+        self.forward_duration = forward_duration
+        self.rot_duration = rot_duration
+        self.lw_offset = lw_offset
+        self.rw_offset = rw_offset
+        self.err_orient = err_orient
+        self.poll_interval = poll_interval
+        self.commands = 0
+
+    def set_motors(self, left, right):
+        # both targets in one batch: a single SET_VARIABLES, the wheels start together
+        self.th.set_vars({"motor.left.target": left, "motor.right.target": right})
+        self.commands += 1
+
+    def stop(self):
+        self.set_motors(0, 0)
+
+    def turn(self, diff_orient):
+        """Rotate in place by diff_orient (positive: turn right), without stopping afterwards.
+        """
+        if diff_orient > 0:
+            self.set_motors(self.rot_speed, -self.rot_speed)
+        else:
+            self.set_motors(-self.rot_speed, self.rot_speed)
+        time.sleep(abs(diff_orient) * self.rot_duration)
+
+    def drive(self, duration, should_stop=None):
+        """Drive forward for duration seconds, return the time actually driven.
+
+        should_stop() is polled every poll_interval and ends the drive early
+        when it returns True.
+        """
+        self.set_motors(self.run_speed + self.lw_offset, self.run_speed + self.rw_offset)
+        t0 = time.monotonic()
+        end = t0 + duration
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                return duration
+            if should_stop is not None and should_stop():
+                return now - t0
+            time.sleep(min(self.poll_interval if should_stop is not None else duration, end - now))
+
+    def execute_segment(self, segment, curr_ang, should_stop=None, stop=True):
+        """Turn to the heading of a segment and drive it in one go, return the number of cells completed.
+        """
+        diff_orient = regulate_angle(curr_ang - segment.heading)
+        if abs(diff_orient) > self.err_orient:
+            self.turn(diff_orient)
+        duration = segment.distance * self.forward_duration
+        driven = self.drive(duration, should_stop)
+        if stop:
+            self.stop()
+        if driven >= duration:
+            return segment.steps
+        return int(segment.steps * driven / duration)
+
+    def execute(self, program, curr_ang, should_stop=None):
+        """Run a whole motion program, the motors only stop at the end.
+
+        Return the number of cells completed, fewer than planned if should_stop interrupted it.
+        """
+        done = 0
+        for segment in program:
+            steps = self.execute_segment(segment, curr_ang, should_stop, stop=False)
+            done += steps
+            curr_ang = segment.heading
+            if steps < segment.steps:
+                break
+        self.stop()
+        return done
@@ -0,0 +1,1031 @@
+# Global path planning on the occupancy grid from vision_func.rasterize
+# Drop-in replacement of A_Star_4_direction from the notebook
+
+import collections
+import hashlib
+import heapq
+import math
+import numpy as np
+
+# (d_row, d_col, cost)
+movements_4 = [(1, 0, 1.0),
+               (0, 1, 1.0),
+               (-1, 0, 1.0),
+               (0, -1, 1.0)]
+
+s2 = math.sqrt(2)
+movements_8 = movements_4 + [(1, 1, s2),
+                             (1, -1, s2),
+                             (-1, 1, s2),
+                             (-1, -1, s2)]
+
+
+def check_points(start, goal, occupancy_grid, Height, Len):
+    """Check that start and goal are inside the map and traversable.
+    """
+    for point in [start, goal]:
+        assert point[0]>=0 and point[1]>=0 and point[0]<Height and point[1]<Len, "start or end goal not contained in the map"
+    if occupancy_grid[start[0], start[1]]:
+        raise Exception('Start node is not traversable')
+    if occupancy_grid[goal[0], goal[1]]:
+        raise Exception('Goal node is not traversable')
+
+
+def reconstruct_path(parent, start_idx, goal_idx, Len):
+    """Follow the parent links from the goal, return (path, control_guide).
+    """
+    optimal_path = [divmod(goal_idx, Len)]
+    idx = goal_idx
+    while idx != start_idx:
+        idx = int(parent[idx])
+        optimal_path.append(divmod(idx, Len))
+    optimal_path.reverse()
+    control_guide = [(b[0]-a[0], b[1]-a[1]) for a, b in zip(optimal_path[:-1], optimal_path[1:])]
+    return optimal_path, control_guide
+
+
+def astar(start, goal, occupancy_grid, movements=movements_4, stats=None, cell_cost=None, quiet=False):
+    """A* with a binary heap open set and flat per-cell arrays.
+
+    Nodes with equal f are expanded in row-major order, like the former
+    A_Star_4_direction, so both return the same path.
+    With cell_cost (array of the grid shape, >= 0, e.g. vision_func.cell_costs),
+    a move into a cell costs its length times 1 + cell_cost: paths keep their
+    distance from the obstacles and the heuristic stays admissible.
+    Return (path, control_guide), or ([], []) if the goal cannot be reached
+    (reported unless quiet, for the searches planners use as probes).
+    """
+    Height, Len = occupancy_grid.shape
+    check_points(start, goal, occupancy_grid, Height, Len)
+    # flat arrays indexed by row * Len + col; plain lists are faster than
+    # NumPy arrays for the element-by-element access of the search loop
+    free = np.logical_not(occupancy_grid).ravel().tolist()
+    gScore = [math.inf] * (Height * Len)
+    closed = bytearray(Height * Len)
+    parent = [-1] * (Height * Len)
+    weight = None if cell_cost is None else (1.0 + np.asarray(cell_cost, np.float64)).ravel().tolist()
+    # heuristics are only computed for the nodes reached by the search
+    hScore = {}
+    gr, gc = goal
+
+    def h(r, c):
+        return math.sqrt((r - gr) ** 2 + (c - gc) ** 2)
+
+    start_idx = start[0] * Len + start[1]
+    goal_idx = gr * Len + gc
+    gScore[start_idx] = 0.0
+    openHeap = [(h(*start), start_idx)]
+    expanded = 0
+    while openHeap:
+        f, current = heapq.heappop(openHeap)
+        if closed[current]:
+            continue
+        if current == goal_idx:
+            if stats is not None:
+                stats["expanded"] = expanded
+            return reconstruct_path(parent, start_idx, goal_idx, Len)
+        closed[current] = True
+        expanded += 1
+        r, c = divmod(current, Len)
+        g = gScore[current]
+        for dr, dc, deltacost in movements:
+            nr, nc = r + dr, c + dc
+            if nr < 0 or nc < 0 or nr >= Height or nc >= Len:
+                continue
+            neighbor = nr * Len + nc
+            if not free[neighbor] or closed[neighbor]:
+                continue
+            # diagonal moves may not cut the corner of an occupied cell
+            if dr and dc and not (free[r * Len + nc] and free[nr * Len + c]):
+                continue
+            tentative_gScore = g + (deltacost if weight is None else deltacost * weight[neighbor])
+            if tentative_gScore < gScore[neighbor]:
+                gScore[neighbor] = tentative_gScore
+                parent[neighbor] = current
+                hn = hScore.get(neighbor)
+                if hn is None:
+                    hn = hScore[neighbor] = h(nr, nc)
+                heapq.heappush(openHeap, (tentative_gScore + hn, neighbor))
+    if stats is not None:
+        stats["expanded"] = expanded
+    if not quiet:
+        print("No path found to goal")
+    return [], []
+
+
+def A_Star_4_direction(start, goal, occupancy_grid, Height, Len):
+    """Same interface and result as the notebook version.
+    """
+    occupancy_grid = np.asarray(occupancy_grid)[:Height, :Len]
+    start = (int(start[0]), int(start[1]))
+    goal = (int(goal[0]), int(goal[1]))
+    return astar(start, goal, occupancy_grid, movements_4)
+
+
+def line_of_sight(occupancy_grid, a, b):
+    """Check that the segment between the centers of cells a and b only crosses free cells.
+
+    Every cell touched by the segment is checked, including both cells at an
+    exact corner crossing.
+    """
+    r0, c0 = a
+    r1, c1 = b
+    dr, dc = abs(r1 - r0), abs(c1 - c0)
+    sr = 1 if r1 > r0 else -1
+    sc = 1 if c1 > c0 else -1
+    r, c = r0, c0
+    if occupancy_grid[r, c]:
+        return False
+    # error term: (crossings of row lines - crossings of col lines) scaled by 2*dr*dc
+    err = dc - dr
+    for _ in range(dr + dc):
+        if err > 0:
+            c += sc
+            err -= 2 * dr
+        elif err < 0:
+            r += sr
+            err += 2 * dc
+        else:
+            # the segment passes exactly through a cell corner
+            if occupancy_grid[r + sr, c] or occupancy_grid[r, c + sc]:
+                return False
+            r += sr
+            c += sc
+            err += 2 * dc - 2 * dr
+        if occupancy_grid[r, c]:
+            return False
+        if r == r1 and c == c1:
+            break
+    return True
+
+
+def waypoint_guide(waypoints):
+    """Convert waypoints to (heading, distance in cells) segments.
+
+    The heading uses the convention of the controller: atan2(d_col, d_row).
+    """
+    return [(math.atan2(b[1]-a[1], b[0]-a[0]), math.hypot(b[0]-a[0], b[1]-a[1]))
+            for a, b in zip(waypoints[:-1], waypoints[1:])]
+
+
+Segment = collections.namedtuple("Segment", ["move", "steps", "first_step", "heading", "distance"])
+
+
+def motion_program(control_guide):
+    """Merge the runs of identical moves of a control guide into segments.
+
+    Each segment gives the move, its number of steps, the index of its first
+    step in control_guide, the heading (convention of the controller,
+    atan2(d_col, d_row)) and the distance in cells.
+    """
+    program = []
+    for i, move in enumerate(control_guide):
+        move = (int(move[0]), int(move[1]))
+        if program and program[-1].move == move:
+            program[-1] = program[-1]._replace(steps=program[-1].steps + 1)
+        else:
+            program.append(Segment(move, 1, i, math.atan2(move[1], move[0]), 0.0))
+    return [segment._replace(distance=segment.steps * math.hypot(*segment.move)) for segment in program]
+
+
+def smooth_path(path, occupancy_grid):
+    """Remove the intermediate cells of a path that are not needed for line of sight.
+    """
+    if len(path) < 3:
+        return list(path)
+    waypoints = [path[0]]
+    i = 0
+    while i < len(path) - 1:
+        j = len(path) - 1
+        while j > i + 1 and not line_of_sight(occupancy_grid, path[i], path[j]):
+            j -= 1
+        waypoints.append(path[j])
+        i = j
+    return waypoints
+
+
+def theta_star(start, goal, occupancy_grid, smooth=True, stats=None):
+    """Any-angle planning (Theta*) on the 8-connected grid.
+
+    Return (waypoints, control_guide) where control_guide holds the (d_row, d_col)
+    displacement between consecutive waypoints; waypoint_guide converts them to
+    headings and distances. With smooth, waypoints that are not needed for line
+    of sight are removed afterwards. ([], []) if the goal cannot be reached.
+    """
+    Height, Len = occupancy_grid.shape
+    check_points(start, goal, occupancy_grid, Height, Len)
+    free = np.logical_not(occupancy_grid).ravel().tolist()
+    gScore = [math.inf] * (Height * Len)
+    closed = bytearray(Height * Len)
+    parent = [-1] * (Height * Len)
+    gr, gc = goal
+
+    def h(r, c):
+        return math.sqrt((r - gr) ** 2 + (c - gc) ** 2)
+
+    start_idx = start[0] * Len + start[1]
+    goal_idx = gr * Len + gc
+    gScore[start_idx] = 0.0
+    parent[start_idx] = start_idx
+    openHeap = [(h(*start), start_idx)]
+    expanded = 0
+    while openHeap:
+        f, current = heapq.heappop(openHeap)
+        if closed[current]:
+            continue
+        if current == goal_idx:
+            break
+        closed[current] = True
+        expanded += 1
+        r, c = divmod(current, Len)
+        pr, pc = divmod(parent[current], Len)
+        for dr, dc, deltacost in movements_8:
+            nr, nc = r + dr, c + dc
+            if nr < 0 or nc < 0 or nr >= Height or nc >= Len:
+                continue
+            neighbor = nr * Len + nc
+            if not free[neighbor] or closed[neighbor]:
+                continue
+            if dr and dc and not (free[r * Len + nc] and free[nr * Len + c]):
+                continue
+            # path 2: connect to the parent of current directly when visible
+            if parent[current] != current and line_of_sight(occupancy_grid, (pr, pc), (nr, nc)):
+                via = parent[current]
+                tentative_gScore = gScore[via] + math.hypot(nr - pr, nc - pc)
+            else:
+                via = current
+                tentative_gScore = gScore[current] + deltacost
+            if tentative_gScore < gScore[neighbor]:
+                gScore[neighbor] = tentative_gScore
+                parent[neighbor] = via
+                heapq.heappush(openHeap, (tentative_gScore + h(nr, nc), neighbor))
+    if stats is not None:
+        stats["expanded"] = expanded
+    if gScore[goal_idx] == math.inf:
+        print("No path found to goal")
+        return [], []
+    waypoints = [goal]
+    idx = goal_idx
+    while idx != start_idx:
+        idx = parent[idx]
+        waypoints.append(divmod(idx, Len))
+    waypoints.reverse()
+    if smooth:
+        waypoints = smooth_path(waypoints, occupancy_grid)
+    control_guide = [(b[0]-a[0], b[1]-a[1]) for a, b in zip(waypoints[:-1], waypoints[1:])]
+    return waypoints, control_guide
+
+
+def A_Star_8_direction(start, goal, occupancy_grid, Height, Len):
+    """8-connected A* without corner cutting, same interface as A_Star_4_direction.
+    """
+    occupancy_grid = np.asarray(occupancy_grid)[:Height, :Len]
+    start = (int(start[0]), int(start[1]))
+    goal = (int(goal[0]), int(goal[1]))
+    return astar(start, goal, occupancy_grid, movements_8)
+
+
+def jump_point_search(start, goal, occupancy_grid, movements=movements_4, stats=None):
+    """Jump Point Search on the uniform-cost grid, 4- or 8-connected (without corner cutting).
+
+    Only the jump points are pushed on the open set, the straight and diagonal
+    runs between them are scanned without being expanded. The path is expanded
+    back to unit steps, so the result is (path, control_guide) like astar, with
+    the same cost. ([], []) if the goal cannot be reached.
+    """
+    Height, Len = occupancy_grid.shape
+    check_points(start, goal, occupancy_grid, Height, Len)
+    octile = len(movements) == 8
+    # padded with a border of occupied cells, so the scans need no bounds checks
+    W = Len + 2
+    free_pad = np.zeros((Height + 2, W), bool)
+    free_pad[1:-1, 1:-1] = np.logical_not(occupancy_grid)
+    free = free_pad.ravel().tolist()
+    gScore = {}
+    closed = bytearray((Height + 2) * W)
+    parent = {}
+    gr, gc = int(goal[0]), int(goal[1])
+    start_idx = (int(start[0]) + 1) * W + int(start[1]) + 1
+    goal_idx = (gr + 1) * W + gc + 1
+
+    def dist(a, b):
+        dr = abs(a // W - b // W)
+        dc = abs(a % W - b % W)
+        if octile:
+            return max(dr, dc) + (s2 - 1) * min(dr, dc)
+        return dr + dc
+
+    def jump_straight(idx, dr, dc):
+        d = dr * W + dc
+        # the two cells beside the direction of the scan
+        side = 1 if dr else W
+        while True:
+            idx += d
+            if not free[idx]:
+                return -1
+            if idx == goal_idx:
+                return idx
+            # forced neighbor: a side cell that is only reachable through this cell
+            if (free[idx + side] and not free[idx + side - d]) or (free[idx - side] and not free[idx - side - d]):
+                return idx
+            # 4-connected: vertical runs stop where a horizontal run finds a jump point
+            if not octile and dr and (jump_straight(idx, 0, 1) >= 0 or jump_straight(idx, 0, -1) >= 0):
+                return idx
+
+    def jump_diagonal(idx, dr, dc):
+        d = dr * W + dc
+        while True:
+            if not (free[idx + dc] and free[idx + dr * W]):
+                return -1
+            idx += d
+            if not free[idx]:
+                return -1
+            if idx == goal_idx:
+                return idx
+            if jump_straight(idx, dr, 0) >= 0 or jump_straight(idx, 0, dc) >= 0:
+                return idx
+
+    def directions(idx):
+        if idx == start_idx:
+            return [(dr, dc) for dr, dc, cost in movements]
+        pr, pc = divmod(parent[idx], W)
+        r, c = divmod(idx, W)
+        dr = (r > pr) - (r < pr)
+        dc = (c > pc) - (c < pc)
+        if dr and dc:
+            return [(dr, 0), (0, dc), (dr, dc)]
+        if octile:
+            if dr:
+                return [(dr, 0), (dr, 1), (dr, -1), (0, 1), (0, -1)]
+            return [(0, dc), (1, dc), (-1, dc), (1, 0), (-1, 0)]
+        if dr:
+            return [(dr, 0), (0, 1), (0, -1)]
+        return [(0, dc), (1, 0), (-1, 0)]
+
+    gScore[start_idx] = 0.0
+    openHeap = [(dist(start_idx, goal_idx), start_idx)]
+    expanded = 0
+    while openHeap:
+        f, current = heapq.heappop(openHeap)
+        if closed[current]:
+            continue
+        if current == goal_idx:
+            break
+        closed[current] = True
+        expanded += 1
+        g = gScore[current]
+        for dr, dc in directions(current):
+            if dr and dc:
+                jump = jump_diagonal(current, dr, dc)
+            else:
+                jump = jump_straight(current, dr, dc)
+            if jump < 0 or closed[jump]:
+                continue
+            tentative_gScore = g + dist(current, jump)
+            if tentative_gScore < gScore.get(jump, math.inf):
+                gScore[jump] = tentative_gScore
+                parent[jump] = current
+                heapq.heappush(openHeap, (tentative_gScore + dist(jump, goal_idx), jump))
+    if stats is not None:
+        stats["expanded"] = expanded
+    if goal_idx not in gScore:
+        print("No path found to goal")
+        return [], []
+    jump_points = [goal_idx]
+    while jump_points[-1] != start_idx:
+        jump_points.append(parent[jump_points[-1]])
+    jump_points.reverse()
+    # expand the straight and diagonal runs between jump points to unit steps
+    optimal_path = [(int(start[0]), int(start[1]))]
+    control_guide = []
+    for a, b in zip(jump_points[:-1], jump_points[1:]):
+        (ar, ac), (br, bc) = divmod(a, W), divmod(b, W)
+        dr = (br > ar) - (br < ar)
+        dc = (bc > ac) - (bc < ac)
+        for _ in range(max(abs(br - ar), abs(bc - ac))):
+            r, c = optimal_path[-1]
+            optimal_path.append((r + dr, c + dc))
+            control_guide.append((dr, dc))
+    return optimal_path, control_guide
+
+
+def JPS_4_direction(start, goal, occupancy_grid, Height, Len):
+    """Jump Point Search with the interface of A_Star_4_direction.
+    """
+    occupancy_grid = np.asarray(occupancy_grid)[:Height, :Len]
+    start = (int(start[0]), int(start[1]))
+    goal = (int(goal[0]), int(goal[1]))
+    return jump_point_search(start, goal, occupancy_grid, movements_4)
+
+
+def JPS_8_direction(start, goal, occupancy_grid, Height, Len):
+    """Jump Point Search with the interface of A_Star_8_direction.
+    """
+    occupancy_grid = np.asarray(occupancy_grid)[:Height, :Len]
+    start = (int(start[0]), int(start[1]))
+    goal = (int(goal[0]), int(goal[1]))
+    return jump_point_search(start, goal, occupancy_grid, movements_8)
+
+
+class DStarLite:
+    """Incremental planner (D* Lite) keeping its search state between replans.
+
+    The search runs backwards from the goal, so after the robot moved or some
+    cells changed only the affected part of the previous solution is repaired.
+    """
+
+    def __init__(self, occupancy_grid, goal, movements=movements_4):
+        self.occupancy_grid = np.array(occupancy_grid, copy=True)
+        self.Height, self.Len = self.occupancy_grid.shape
+        self.goal = (int(goal[0]), int(goal[1]))
+        self.movements = movements
+        self.octile = len(movements) == 8
+        self.free = np.logical_not(self.occupancy_grid).ravel().tolist()
+        n = self.Height * self.Len
+        self.g = [math.inf] * n
+        self.rhs = [math.inf] * n
+        self.open_key = {}
+        self.open_heap = []
+        self.km = 0.0
+        self.start = None
+        self.goal_idx = self.goal[0] * self.Len + self.goal[1]
+        self.rhs[self.goal_idx] = 0.0
+        self.expanded = 0
+
+    def h(self, a, b):
+        dr = abs(a // self.Len - b // self.Len)
+        dc = abs(a % self.Len - b % self.Len)
+        if self.octile:
+            return max(dr, dc) + (s2 - 1) * min(dr, dc)
+        # euclidean rather than manhattan: fewer ties between keys on open grids
+        return math.sqrt(dr * dr + dc * dc)
+
+    def neighbors(self, idx):
+        r, c = divmod(idx, self.Len)
+        for dr, dc, cost in self.movements:
+            nr, nc = r + dr, c + dc
+            if 0 <= nr < self.Height and 0 <= nc < self.Len:
+                yield nr * self.Len + nc, cost, dr, dc
+
+    def cost(self, a, b, cost, dr, dc):
+        # moving between two free cells, diagonals may not cut an occupied corner
+        if not (self.free[a] and self.free[b]):
+            return math.inf
+        if dr and dc:
+            r, c = divmod(a, self.Len)
+            if not (self.free[r * self.Len + c + dc] and self.free[(r + dr) * self.Len + c]):
+                return math.inf
+        return cost
+
+    def key(self, idx):
+        m = min(self.g[idx], self.rhs[idx])
+        return (m + self.h(self.start_idx, idx) + self.km, m)
+
+    def update_vertex(self, idx):
+        if self.g[idx] != self.rhs[idx]:
+            key = self.key(idx)
+            self.open_key[idx] = key
+            heapq.heappush(self.open_heap, (key[0], key[1], idx))
+        elif idx in self.open_key:
+            del self.open_key[idx]
+
+    def top(self):
+        # skip the heap entries that were updated or removed since they were pushed
+        while self.open_heap:
+            k1, k2, idx = self.open_heap[0]
+            if self.open_key.get(idx) == (k1, k2):
+                return (k1, k2), idx
+            heapq.heappop(self.open_heap)
+        return (math.inf, math.inf), None
+
+    def best_rhs(self, idx):
+        return min((self.cost(idx, s, cost, dr, dc) + self.g[s] for s, cost, dr, dc in self.neighbors(idx)),
+                   default=math.inf)
+
+    def compute_shortest_path(self):
+        start_idx = self.start_idx
+        while True:
+            k_old, u = self.top()
+            if u is None:
+                break
+            if not (k_old < self.key(start_idx) or self.rhs[start_idx] != self.g[start_idx]):
+                break
+            k_new = self.key(u)
+            if k_old < k_new:
+                self.open_key[u] = k_new
+                heapq.heappush(self.open_heap, (k_new[0], k_new[1], u))
+                continue
+            self.expanded += 1
+            del self.open_key[u]
+            if self.g[u] > self.rhs[u]:
+                self.g[u] = self.rhs[u]
+                for s, cost, dr, dc in self.neighbors(u):
+                    if s != self.goal_idx:
+                        # the movements are symmetric: edge s -> u is (-dr, -dc)
+                        self.rhs[s] = min(self.rhs[s], self.cost(s, u, cost, -dr, -dc) + self.g[u])
+                        self.update_vertex(s)
+            else:
+                g_old = self.g[u]
+                self.g[u] = math.inf
+                for s, cost, dr, dc in list(self.neighbors(u)) + [(u, 0.0, 0, 0)]:
+                    if s != self.goal_idx and self.rhs[s] == self.cost(s, u, cost, -dr, -dc) + g_old:
+                        self.rhs[s] = self.best_rhs(s)
+                    self.update_vertex(s)
+
+    def update_cells(self, changed_cells, occupancy_grid):
+        """Apply the new occupancy of the changed cells and repair the affected vertices.
+        """
+        dirty = set()
+        for (r, c) in changed_cells:
+            idx = r * self.Len + c
+            self.occupancy_grid[r, c] = occupancy_grid[r, c]
+            self.free[idx] = not occupancy_grid[r, c]
+            dirty.add(idx)
+            # diagonal corner rules also depend on the cells next to the edge
+            dirty.update(s for s, cost, dr, dc in self.neighbors(idx))
+            if self.octile:
+                for s, cost, dr, dc in list(self.neighbors(idx)):
+                    dirty.update(t for t, cost2, dr2, dc2 in self.neighbors(s))
+        for idx in dirty:
+            if idx != self.goal_idx:
+                self.rhs[idx] = self.best_rhs(idx)
+            self.update_vertex(idx)
+
+    def replan(self, start, occupancy_grid=None, changed_cells=None):
+        """Plan from a new start, after applying the changed cells of a new occupancy grid.
+
+        Without changed_cells, they are found by comparing occupancy_grid with
+        the current map. Return (path, control_guide), ([], []) if unreachable.
+        """
+        if changed_cells and occupancy_grid is None:
+            raise ValueError("changed_cells needs the occupancy_grid they are read from")
+        start = (int(start[0]), int(start[1]))
+        if occupancy_grid is not None:
+            occupancy_grid = np.asarray(occupancy_grid)
+            if changed_cells is None:
+                changed_cells = [tuple(p) for p in np.argwhere(
+                    (occupancy_grid != 0) != (self.occupancy_grid != 0))]
+        check_points(start, self.goal, occupancy_grid if occupancy_grid is not None else self.occupancy_grid,
+                     self.Height, self.Len)
+        start_idx = start[0] * self.Len + start[1]
+        if self.start is None:
+            self.start_idx = start_idx
+            self.open_key[self.goal_idx] = self.key(self.goal_idx)
+            heapq.heappush(self.open_heap, self.open_key[self.goal_idx] + (self.goal_idx,))
+        else:
+            self.km += self.h(self.start_idx, start_idx)
+            self.start_idx = start_idx
+        self.start = start
+        if changed_cells:
+            self.update_cells(changed_cells, occupancy_grid)
+        self.compute_shortest_path()
+        return self.extract_path()
+
+    def extract_path(self):
+        idx = self.start_idx
+        if self.g[idx] == math.inf:
+            print("No path found to goal")
+            return [], []
+        optimal_path = [self.start]
+        while idx != self.goal_idx:
+            best, best_cost = None, math.inf
+            for s, cost, dr, dc in self.neighbors(idx):
+                total = self.cost(idx, s, cost, dr, dc) + self.g[s]
+                if total < best_cost:
+                    best, best_cost = s, total
+            if best is None:
+                print("No path found to goal")
+                return [], []
+            idx = best
+            optimal_path.append(divmod(idx, self.Len))
+        control_guide = [(b[0]-a[0], b[1]-a[1]) for a, b in zip(optimal_path[:-1], optimal_path[1:])]
+        return optimal_path, control_guide
+
+
+def distance_fields(occupancy_grid, sources, movements=movements_4):
+    """Cost from each source to every cell, stacked as (len(sources), Height, Len).
+
+    Vectorized wavefront: every sweep relaxes all cells of all fields at once
+    through each movement, until no distance decreases. Occupied or
+    unreachable cells are inf.
+    """
+    occupied = np.asarray(occupancy_grid) != 0
+    Height, Len = occupied.shape
+    free = ~occupied
+    dist = np.full((len(sources), Height + 2, Len + 2), np.inf)
+    inner = dist[:, 1:-1, 1:-1]
+    for i, (r, c) in enumerate(sources):
+        inner[i, r, c] = 0.0
+    # padded free mask so that shifted views stay inside the array
+    free_pad = np.zeros((Height + 2, Len + 2), bool)
+    free_pad[1:-1, 1:-1] = free
+    moves = []
+    for dr, dc, cost in movements:
+        allowed = free.copy()
+        if dr and dc:
+            # no corner cutting: both cells next to the diagonal must be free
+            allowed &= free_pad[1 + dr:Height + 1 + dr, 1:-1] & free_pad[1:-1, 1 + dc:Len + 1 + dc]
+        moves.append((dr, dc, cost, allowed))
+    while True:
+        changed = False
+        for dr, dc, cost, allowed in moves:
+            via = dist[:, 1 + dr:Height + 1 + dr, 1 + dc:Len + 1 + dc] + cost
+            better = allowed & (via < inner)
+            if better.any():
+                np.copyto(inner, via, where=better)
+                changed = True
+        if not changed:
+            return inner.copy()
+
+
+def goal_distance_field(occupancy_grid, goal, movements=movements_4):
+    """Cost-to-goal of every cell, inf for occupied or unreachable cells.
+    """
+    return distance_fields(occupancy_grid, [goal], movements)[0]
+
+
+class GoalField:
+    """Precomputed cost-to-goal field, the next move from any cell is a lookup.
+
+    The field is recomputed only when the map version (or, without version,
+    the occupancy grid) changes.
+    """
+
+    def __init__(self, goal, movements=movements_4):
+        self.goal = (int(goal[0]), int(goal[1]))
+        self.movements = movements
+        self.version = None
+        self.occupancy_grid = None
+        self.dist = None
+        self.computations = 0
+
+    def update(self, occupancy_grid, version=None):
+        """Recompute the field if the map changed, return True if it was recomputed.
+        """
+        occupancy_grid = np.asarray(occupancy_grid)
+        if self.dist is not None:
+            if version is not None and version == self.version:
+                return False
+            if version is None and np.array_equal(occupancy_grid, self.occupancy_grid):
+                return False
+        self.version = version
+        self.occupancy_grid = occupancy_grid.copy()
+        self.dist = goal_distance_field(occupancy_grid, self.goal, self.movements)
+        self.computations += 1
+        return True
+
+    def next_move(self, cell):
+        """Best (d_row, d_col) move from a cell, None at the goal or if the goal is unreachable.
+        """
+        r, c = cell
+        Height, Len = self.dist.shape
+        best, best_cost = None, self.dist[r, c]
+        for dr, dc, cost in self.movements:
+            nr, nc = r + dr, c + dc
+            if not (0 <= nr < Height and 0 <= nc < Len):
+                continue
+            if dr and dc and (self.occupancy_grid[r, nc] or self.occupancy_grid[nr, c]):
+                continue
+            total = self.dist[nr, nc] + cost
+            # the move has to follow the gradient of the field
+            if total <= self.dist[r, c] + 1e-9 and self.dist[nr, nc] < best_cost:
+                best, best_cost = (dr, dc), self.dist[nr, nc]
+        return best
+
+    def path(self, start):
+        """Follow the field from start, return (path, control_guide) like A_Star_4_direction.
+        """
+        start = (int(start[0]), int(start[1]))
+        Height, Len = self.dist.shape
+        check_points(start, self.goal, self.occupancy_grid, Height, Len)
+        if self.dist[start] == np.inf:
+            print("No path found to goal")
+            return [], []
+        optimal_path = [start]
+        control_guide = []
+        current = start
+        while current != self.goal:
+            move = self.next_move(current)
+            current = (current[0] + move[0], current[1] + move[1])
+            optimal_path.append(current)
+            control_guide.append(move)
+        return optimal_path, control_guide
+
+
+def pack_grid(occupancy_grid):
+    """Occupied cells of a grid packed as bytes, shape included.
+    """
+    occupied = np.ascontiguousarray(np.asarray(occupancy_grid) != 0)
+    return np.packbits(occupied).tobytes() + str(occupied.shape).encode()
+
+
+def packed_fingerprint(packed):
+    """Digest of a grid packed by pack_grid.
+    """
+    return hashlib.blake2b(packed, digest_size=16).digest()
+
+
+def map_fingerprint(occupancy_grid):
+    """Cheap digest of the occupied cells of a grid.
+    """
+    return packed_fingerprint(pack_grid(occupancy_grid))
+
+
+class PlanCache:
+    """LRU cache of plans around a planner with the A_Star_4_direction interface.
+
+    Entries are keyed on the map fingerprint, start and goal; the packed grid
+    is kept with each entry and compared on a hit, so a plan is never served
+    for a different occupancy grid.
+    """
+
+    def __init__(self, planner=None, maxsize=128):
+        self.planner = A_Star_4_direction if planner is None else planner
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, start, goal, occupancy_grid, Height, Len):
+        occupancy_grid = np.asarray(occupancy_grid)[:Height, :Len]
+        packed = pack_grid(occupancy_grid)
+        key = (packed_fingerprint(packed),
+               (int(start[0]), int(start[1])), (int(goal[0]), int(goal[1])))
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == packed:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return list(entry[1]), list(entry[2])
+        self.misses += 1
+        path, control_guide = self.planner(start, goal, occupancy_grid, Height, Len)
+        self.entries[key] = (packed, list(path), list(control_guide))
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return path, control_guide
+
+    def clear(self):
+        """Drop all entries, keep the statistics.
+        """
+        self.entries.clear()
+
+    def stats(self):
+        """Get the hit-rate statistics.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class HierarchicalPlanner:
+    """HPA*-style planner for large grids.
+
+    The grid is split into square clusters. Entrances are placed on the free
+    runs of every border between two clusters, and the costs between the
+    entrances of a cluster are precomputed. A query searches this abstract
+    graph and refines each step with a local astar inside one cluster, so it
+    costs about the path length rather than the arena area. Paths are close
+    to, but not always exactly, the shortest ones: on random 40x60 maps about
+    one path in six (4 directions) and two in three (8 directions) is longer,
+    by 1 to 3% on average and up to about 11%. Use astar or jump_point_search
+    where the shortest path matters.
+    """
+
+    # free runs at least this long get an entrance at both ends instead of one in the middle
+    wide_entrance = 6
+
+    def __init__(self, occupancy_grid, cluster_size=10, movements=movements_4):
+        self.cluster_size = cluster_size
+        self.movements = movements
+        self.octile = len(movements) == 8
+        self.occupancy_grid = None
+        self.rebuilt = 0
+        self.expanded = 0
+        self.update(occupancy_grid)
+
+    def cluster(self, cell):
+        return (cell[0] // self.cluster_size, cell[1] // self.cluster_size)
+
+    def bounds(self, cid):
+        """(row0, row1, col0, col1) of a cluster.
+        """
+        r0, c0 = cid[0] * self.cluster_size, cid[1] * self.cluster_size
+        return r0, min(r0 + self.cluster_size, self.Height), c0, min(c0 + self.cluster_size, self.Len)
+
+    def borders(self, cid):
+        """Keys (first cluster, second cluster) of the borders of a cluster.
+        """
+        br, bc = cid
+        keys = []
+        if br > 0:
+            keys.append(((br - 1, bc), cid))
+        if bc > 0:
+            keys.append(((br, bc - 1), cid))
+        if br + 1 < self.clusters[0]:
+            keys.append((cid, (br + 1, bc)))
+        if bc + 1 < self.clusters[1]:
+            keys.append((cid, (br, bc + 1)))
+        return keys
+
+    def find_transitions(self, key):
+        """Pairs (cell in first cluster, cell in second cluster) crossing a border.
+        """
+        a, b = key
+        r0, r1, c0, c1 = self.bounds(a)
+        if b[0] > a[0]:
+            # horizontal border below a
+            line = np.logical_not(self.occupancy_grid[r1 - 1, c0:c1] | self.occupancy_grid[r1, c0:c1])
+            cells = [((r1 - 1, c), (r1, c)) for c in range(c0, c1)]
+        else:
+            line = np.logical_not(self.occupancy_grid[r0:r1, c1 - 1] | self.occupancy_grid[r0:r1, c1])
+            cells = [((r, c1 - 1), (r, c1)) for r in range(r0, r1)]
+        transitions = []
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], line.astype(np.int8), [0]))))
+        for start, end in zip(edges[::2], edges[1::2]):
+            if end - start >= self.wide_entrance:
+                transitions += [cells[start], cells[end - 1]]
+            else:
+                transitions.append(cells[(start + end - 1) // 2])
+        return transitions
+
+    def set_border(self, key):
+        """Recompute the entrances of a border, return True if they changed.
+        """
+        transitions = self.find_transitions(key)
+        old = self.transitions.get(key, [])
+        if transitions == old:
+            return False
+        for a, b in old:
+            self.inter[a].discard(b)
+            self.inter[b].discard(a)
+        for a, b in transitions:
+            self.inter.setdefault(a, set()).add(b)
+            self.inter.setdefault(b, set()).add(a)
+        self.transitions[key] = transitions
+        return True
+
+    def entrances(self, cid):
+        nodes = set()
+        for key in self.borders(cid):
+            side = 0 if key[0] == cid else 1
+            nodes.update(t[side] for t in self.transitions.get(key, []))
+        return sorted(nodes)
+
+    def local_fields(self, cid, sources):
+        r0, r1, c0, c1 = self.bounds(cid)
+        return distance_fields(self.occupancy_grid[r0:r1, c0:c1],
+                               [(r - r0, c - c0) for r, c in sources], self.movements)
+
+    def build_cluster(self, cid):
+        """Recompute the costs between the entrances of a cluster.
+        """
+        nodes = self.entrances(cid)
+        edges = {n: [] for n in nodes}
+        if nodes:
+            r0, r1, c0, c1 = self.bounds(cid)
+            fields = self.local_fields(cid, nodes)
+            for i, a in enumerate(nodes):
+                for b in nodes[i + 1:]:
+                    d = fields[i, b[0] - r0, b[1] - c0]
+                    if d < math.inf:
+                        edges[a].append((b, d))
+                        edges[b].append((a, d))
+        self.intra[cid] = edges
+        self.rebuilt += 1
+
+    def update(self, occupancy_grid):
+        """Apply a new occupancy grid, return the number of clusters rebuilt.
+
+        Only the clusters with changed cells, and their neighbors whose
+        entrances moved, are rebuilt.
+        """
+        occupancy_grid = np.asarray(occupancy_grid) != 0
+        if self.occupancy_grid is None or occupancy_grid.shape != self.occupancy_grid.shape:
+            self.occupancy_grid = occupancy_grid.copy()
+            self.Height, self.Len = occupancy_grid.shape
+            self.clusters = (-(-self.Height // self.cluster_size), -(-self.Len // self.cluster_size))
+            self.transitions = {}
+            self.inter = {}
+            self.intra = {}
+            dirty = [(br, bc) for br in range(self.clusters[0]) for bc in range(self.clusters[1])]
+        else:
+            changed = np.argwhere(occupancy_grid != self.occupancy_grid)
+            if len(changed) == 0:
+                return 0
+            self.occupancy_grid = occupancy_grid.copy()
+            dirty = {self.cluster(cell) for cell in changed.tolist()}
+        rebuild = set(dirty)
+        for cid in dirty:
+            for key in self.borders(cid):
+                if self.set_border(key):
+                    rebuild.update(key)
+        for cid in rebuild:
+            self.build_cluster(cid)
+        return len(rebuild)
+
+    def h(self, a, b):
+        dr, dc = abs(a[0] - b[0]), abs(a[1] - b[1])
+        if self.octile:
+            return max(dr, dc) + (s2 - 1) * min(dr, dc)
+        return dr + dc
+
+    def local_path(self, a, b):
+        """Shortest path from a to b inside the cluster of a.
+        """
+        r0, r1, c0, c1 = self.bounds(self.cluster(a))
+        path, control_guide = astar((a[0] - r0, a[1] - c0), (b[0] - r0, b[1] - c0),
+                                    self.occupancy_grid[r0:r1, c0:c1], self.movements, quiet=True)
+        return [(r + r0, c + c0) for r, c in path], control_guide
+
+    def plan(self, start, goal):
+        """Plan on the current map, return (path, control_guide) like A_Star_4_direction.
+        """
+        start = (int(start[0]), int(start[1]))
+        goal = (int(goal[0]), int(goal[1]))
+        check_points(start, goal, self.occupancy_grid, self.Height, self.Len)
+        # connect start and goal to the entrances of their clusters
+        start_edges = {}
+        goal_edges = {}
+        for cell, edges in ((start, start_edges), (goal, goal_edges)):
+            cid = self.cluster(cell)
+            r0, r1, c0, c1 = self.bounds(cid)
+            field = self.local_fields(cid, [cell])[0]
+            targets = self.entrances(cid)
+            if edges is start_edges and self.cluster(goal) == cid:
+                targets.append(goal)
+            for n in targets:
+                d = field[n[0] - r0, n[1] - c0]
+                if d < math.inf:
+                    edges[n] = d
+        gScore = {start: 0.0}
+        parent = {start: None}
+        closed = set()
+        openHeap = [(self.h(start, goal), start)]
+        self.expanded = 0
+        while openHeap:
+            f, current = heapq.heappop(openHeap)
+            if current in closed:
+                continue
+            if current == goal:
+                break
+            closed.add(current)
+            self.expanded += 1
+            g = gScore[current]
+            neighbors = list(self.intra[self.cluster(current)].get(current, []))
+            neighbors += [(n, 1.0) for n in self.inter.get(current, ())]
+            if current == start:
+                neighbors += start_edges.items()
+            if current in goal_edges:
+                neighbors.append((goal, goal_edges[current]))
+            for n, d in neighbors:
+                tentative_gScore = g + d
+                if n not in closed and tentative_gScore < gScore.get(n, math.inf):
+                    gScore[n] = tentative_gScore
+                    parent[n] = current
+                    heapq.heappush(openHeap, (tentative_gScore + self.h(n, goal), n))
+        if goal not in gScore:
+            print("No path found to goal")
+            return [], []
+        # short queries between neighboring clusters: the entrances can force a
+        # detour, so a search over the window of both clusters is tried as well
+        (sr, sc), (tr, tc) = self.cluster(start), self.cluster(goal)
+        if abs(sr - tr) <= 1 and abs(sc - tc) <= 1:
+            r0 = self.bounds((min(sr, tr), 0))[0]
+            r1 = self.bounds((max(sr, tr), 0))[1]
+            c0 = self.bounds((0, min(sc, tc)))[2]
+            c1 = self.bounds((0, max(sc, tc)))[3]
+            path, control_guide = astar((start[0] - r0, start[1] - c0), (goal[0] - r0, goal[1] - c0),
+                                        self.occupancy_grid[r0:r1, c0:c1], self.movements, quiet=True)
+            if path:
+                window_cost = sum(math.hypot(dr, dc) for dr, dc in control_guide)
+                if window_cost <= gScore[goal] + 1e-9:
+                    return [(r + r0, c + c0) for r, c in path], control_guide
+        nodes = [goal]
+        while parent[nodes[-1]] is not None:
+            nodes.append(parent[nodes[-1]])
+        nodes.reverse()
+        # refine every abstract step: a border crossing or a path inside one cluster
+        optimal_path = [start]
+        control_guide = []
+        for a, b in zip(nodes[:-1], nodes[1:]):
+            if self.cluster(a) != self.cluster(b):
+                optimal_path.append(b)
+                control_guide.append((b[0] - a[0], b[1] - a[1]))
+            elif a != b:
+                path, guide = self.local_path(a, b)
+                optimal_path += path[1:]
+                control_guide += guide
+        return optimal_path, control_guide
+
+    def __call__(self, start, goal, occupancy_grid, Height, Len):
+        """Same interface as A_Star_4_direction, the map is updated first.
+        """
+        self.update(np.asarray(occupancy_grid)[:Height, :Len])
+        return self.plan(start, goal)
@@ -0,0 +1,166 @@
+# Shared-memory channel from the vision process to the control process
+# Replaces the ./npy/points.npy and ./npy/global_map.npy handoff (needs Python >= 3.8)
+#
+# Vision side:
+#   channel = StateChannel.create("thymio_state", grid_shape=(14, 20))
+#   channel.publish(grid_array_start, start_direction, grid_array_end, grid_array_output)
+# Control side:
+#   channel = StateChannel.attach("thymio_state")
+#   state = channel.read()
+#   curr_pos, ang_vec, goal, globalmap = state.start, state.direction, state.goal, state.grid
+
+import collections
+from multiprocessing import shared_memory
+import time
+import numpy as np
+
+StateSnapshot = collections.namedtuple("StateSnapshot",
+                                       ["version", "start", "direction", "goal", "grid", "slot", "slot_seq"])
+
+# header: version of the last published state, grid rows, grid cols
+HEADER_WORDS = 3
+# pose of a slot: seqlock counter, start row/col, direction row/col, goal row/col
+POSE_WORDS = 7
+
+
+class StateChannel:
+    """Pose, goal and occupancy grid in shared memory.
+
+    Two slots are written alternately, each guarded by its own seqlock counter,
+    so readers get views of the last complete state without copying the grid.
+    """
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((HEADER_WORDS,), np.int64, shm.buf, 0)
+        rows, cols = int(self.header[1]), int(self.header[2])
+        slot_size = POSE_WORDS * 8 + rows * cols
+        self.poses = []
+        self.grids = []
+        for slot in range(2):
+            offset = HEADER_WORDS * 8 + slot * slot_size
+            self.poses.append(np.ndarray((POSE_WORDS,), np.int64, shm.buf, offset))
+            self.grids.append(np.ndarray((rows, cols), np.uint8, shm.buf, offset + POSE_WORDS * 8))
+
+    @staticmethod
+    def size(grid_shape):
+        """Size in bytes of the shared block for a grid shape.
+        """
+        return HEADER_WORDS * 8 + 2 * (POSE_WORDS * 8 + grid_shape[0] * grid_shape[1])
+
+    @staticmethod
+    def create(name=None, grid_shape=(14, 20)):
+        """Create the shared block (vision side).
+        """
+        shm = shared_memory.SharedMemory(name=name, create=True, size=StateChannel.size(grid_shape))
+        header = np.ndarray((HEADER_WORDS,), np.int64, shm.buf, 0)
+        header[:] = [0, grid_shape[0], grid_shape[1]]
+        del header
+        return StateChannel(shm, owner=True)
+
+    @staticmethod
+    def attach(name):
+        """Attach to an existing shared block (control side).
+        """
+        return StateChannel(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def grid_shape(self):
+        return self.grids[0].shape
+
+    def version(self):
+        """Version of the last published state, 0 if nothing was published yet.
+        """
+        return int(self.header[0])
+
+    def publish(self, start, direction, goal, grid):
+        """Write a new state (single writer).
+        """
+        if np.shape(grid) != self.grid_shape:
+            raise ValueError(f"grid shape {np.shape(grid)} instead of {self.grid_shape}")
+        version = int(self.header[0]) + 1
+        slot = version % 2
+        pose = self.poses[slot]
+        pose[0] += 1  # odd: slot being written
+        try:
+            pose[1:] = [start[0], start[1], direction[0], direction[1], goal[0], goal[1]]
+            np.copyto(self.grids[slot], grid, casting="unsafe")
+        finally:
+            # even again even if the write failed, the version is only published on success
+            pose[0] += 1
+        self.header[0] = version
+        return version
+
+    @staticmethod
+    def backoff(attempt, deadline):
+        # yield to the writer, then sleep a little if it takes longer (or died mid-write)
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError("no consistent state, the writer may have stopped in the middle of a publish")
+        time.sleep(0 if attempt < 100 else 0.001)
+
+    def snapshot(self, timeout=None):
+        """Get the last published state without copying the grid, None if there is none.
+
+        The grid is a view which stays valid while `is_valid(snapshot)` is True.
+        With a timeout in s, raise TimeoutError if no consistent state could be read.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        while True:
+            version = int(self.header[0])
+            if version == 0:
+                return None
+            slot = version % 2
+            pose = self.poses[slot]
+            slot_seq = int(pose[0])
+            if slot_seq % 2 == 0:
+                values = pose[1:].tolist()
+                state = StateSnapshot(version, (values[0], values[1]), (values[2], values[3]),
+                                      (values[4], values[5]), self.grids[slot], slot, slot_seq)
+                if self.is_valid(state):
+                    return state
+            self.backoff(attempt, deadline)
+            attempt += 1
+
+    def is_valid(self, state):
+        """Check that the slot of a snapshot was not overwritten since it was taken.
+        """
+        return int(self.poses[state.slot][0]) == state.slot_seq
+
+    def read(self, copy_grid=False, timeout=None):
+        """Get a consistent snapshot, optionally with a private copy of the grid.
+
+        With a timeout in s, raise TimeoutError if no consistent state could be read.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        while True:
+            state = self.snapshot(None if deadline is None else max(deadline - time.monotonic(), 0))
+            if state is None or not copy_grid:
+                return state
+            grid = state.grid.copy()
+            if self.is_valid(state):
+                return state._replace(grid=grid)
+            self.backoff(attempt, deadline)
+            attempt += 1
+
+    def close(self):
+        """Detach from the shared block, and remove it if this side created it.
+        """
+        self.header = None
+        self.poses = []
+        self.grids = []
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+import planner
+
+
+def test_dstar_changed_cells_need_grid():
+    dstar = planner.DStarLite(np.zeros((5, 5), np.uint8), (4, 4))
+    dstar.replan((0, 0))
+    with pytest.raises(ValueError):
+        dstar.replan((0, 1), changed_cells=[(2, 2)])
+    grid = np.zeros((5, 5), np.uint8)
+    grid[2, :4] = 1
+    path, control_guide = dstar.replan((0, 1), grid, changed_cells=[(2, c) for c in range(4)])
+    assert path[0] == (0, 1) and path[-1] == (4, 4)
+    assert all(not grid[p] for p in path)
+
+
+def test_astar_cell_cost_keeps_away_from_obstacles():
+    grid = np.zeros((14, 20), np.uint8)
+    grid[3:11, 8:12] = 1
+    # cells next to the obstacle cost 1, three cells away 0
+    rows, cols = np.indices(grid.shape)
+    distance = np.maximum(np.maximum(3 - rows, rows - 10), np.maximum(8 - cols, cols - 11))
+    cell_cost = np.clip(1.0 - (distance - 1) / 3, 0, 1)
+    start, goal = (7, 1), (7, 18)
+    assert planner.astar(start, goal, grid, cell_cost=np.zeros(grid.shape)) == planner.astar(start, goal, grid)
+    plain, _ = planner.astar(start, goal, grid)
+    path, control_guide = planner.astar(start, goal, grid, cell_cost=cell_cost)
+    assert path[0] == start and path[-1] == goal and not any(grid[p] for p in path)
+    assert sum(cell_cost[p] for p in path) < sum(cell_cost[p] for p in plain)
+
+
+def path_cost(control_guide):
+    return sum(np.hypot(dr, dc) for dr, dc in control_guide)
+
+
+def check_path(path, control_guide, start, goal, grid, movements):
+    # starts and ends where asked, free cells only, allowed moves without cutting occupied corners
+    assert path[0] == start and path[-1] == goal
+    assert not any(grid[p] for p in path)
+    moves = {(dr, dc) for dr, dc, cost in movements}
+    for (r, c), (dr, dc) in zip(path[:-1], control_guide):
+        assert (dr, dc) in moves
+        if dr and dc:
+            assert not grid[r + dr, c] and not grid[r, c + dc]
+
+
+def random_queries(n_maps=30, shape=(20, 30)):
+    rng = np.random.RandomState(0)
+    for k in range(n_maps):
+        grid = (rng.rand(*shape) < 0.1 + 0.25 * k / n_maps).astype(np.uint8)
+        free = np.argwhere(grid == 0)
+        start, goal = (tuple(int(v) for v in free[i]) for i in rng.choice(len(free), 2, replace=False))
+        yield grid, start, goal
+
+
+def check_same_cost(plan, movements):
+    # same path cost as astar on every random query, no path when astar has none
+    for grid, start, goal in random_queries():
+        expected_path, expected_guide = planner.astar(start, goal, grid, movements)
+        path, control_guide = plan(start, goal, grid, movements)
+        if not expected_path:
+            assert path == []
+            continue
+        check_path(path, control_guide, start, goal, grid, movements)
+        assert path_cost(control_guide) == pytest.approx(path_cost(expected_guide))
+
+
+@pytest.mark.parametrize("movements", [planner.movements_4, planner.movements_8], ids=["4", "8"])
+def test_dstar_matches_astar(movements):
+    check_same_cost(lambda start, goal, grid, movements: planner.DStarLite(grid, goal, movements).replan(start),
+                    movements)
+
+
+def test_dstar_replan_matches_astar_after_changes():
+    rng = np.random.RandomState(1)
+    grid = (rng.rand(20, 30) < 0.2).astype(np.uint8)
+    goal = (19, 29)
+    grid[goal] = 0
+    dstar = planner.DStarLite(grid, goal)
+    start = (0, 0)
+    for step in range(10):
+        grid = grid.copy()
+        grid[rng.randint(20), rng.randint(30)] ^= 1
+        grid[start] = grid[goal] = 0
+        path, control_guide = dstar.replan(start, grid)
+        expected_path, expected_guide = planner.astar(start, goal, grid)
+        if not expected_path:
+            assert path == []
+            continue
+        check_path(path, control_guide, start, goal, grid, planner.movements_4)
+        assert path_cost(control_guide) == pytest.approx(path_cost(expected_guide))
+        start = path[min(2, len(path) - 1)]
+
+
+def goal_field_path(start, goal, grid, movements):
+    field = planner.GoalField(goal, movements)
+    field.update(grid)
+    return field.path(start)
+
+
+@pytest.mark.parametrize("movements", [planner.movements_4, planner.movements_8], ids=["4", "8"])
+def test_goal_field_matches_astar(movements):
+    check_same_cost(goal_field_path, movements)
+
+
+@pytest.mark.parametrize("movements", [planner.movements_4, planner.movements_8], ids=["4", "8"])
+def test_jump_point_search_matches_astar(movements):
+    check_same_cost(planner.jump_point_search, movements)
+
+
+@pytest.mark.parametrize("movements", [planner.movements_4, planner.movements_8], ids=["4", "8"])
+def test_hierarchical_planner_paths_are_valid(movements):
+    # not always the shortest path: only validity and a bounded detour are checked
+    for grid, start, goal in random_queries(shape=(40, 60)):
+        hpa = planner.HierarchicalPlanner(grid, 10, movements)
+        path, control_guide = hpa.plan(start, goal)
+        expected_path, expected_guide = planner.astar(start, goal, grid, movements)
+        if not expected_path:
+            assert path == []
+            continue
+        check_path(path, control_guide, start, goal, grid, movements)
+        assert path_cost(expected_guide) - 1e-9 <= path_cost(control_guide) <= 1.5 * path_cost(expected_guide) + 2
+
+
+def test_hierarchical_planner_reports_only_real_failures(capsys):
+    # the window probe between neighboring clusters fails silently in a maze
+    grid = np.ones((14, 20), np.uint8)
+    grid[0, :] = grid[:, 19] = grid[13, :] = 0
+    hpa = planner.HierarchicalPlanner(grid, 10)
+    path, control_guide = hpa.plan((0, 0), (13, 0))
+    assert len(path) == 52
+    assert "No path" not in capsys.readouterr().out
+    grid[6, 19] = 1
+    hpa.update(grid)
+    assert hpa.plan((0, 0), (13, 0)) == ([], [])
+    assert "No path" in capsys.readouterr().out
+
+
+def test_plan_cache_keyed_on_map_fingerprint():
+    grid = np.zeros((5, 6), np.uint8)
+    cache = planner.PlanCache()
+    first = cache((0, 0), (4, 5), grid, 5, 6)
+    assert cache((0, 0), (4, 5), grid.copy(), 5, 6) == first
+    assert list(cache.entries)[0][0] == planner.map_fingerprint(grid)
+    grid[2, :5] = 1
+    path, control_guide = cache((0, 0), (4, 5), grid, 5, 6)
+    assert (2, 5) in path
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from shared_state import StateChannel
+
+
+@pytest.fixture
+def channel():
+    channel = StateChannel.create(None, grid_shape=(4, 5))
+    yield channel
+    channel.close()
+
+
+def test_publish_read(channel):
+    assert channel.read() is None
+    grid = np.arange(20, dtype=np.uint8).reshape(4, 5) % 2
+    assert channel.publish((1, 2), (0, 1), (3, 4), grid) == 1
+    state = channel.read(copy_grid=True)
+    assert (state.version, state.start, state.direction, state.goal) == (1, (1, 2), (0, 1), (3, 4))
+    assert np.array_equal(state.grid, grid)
+
+
+def test_failed_publish_keeps_counters_even(channel):
+    with pytest.raises(ValueError):
+        channel.publish((0, 0), (1, 0), (3, 3), np.zeros((5, 5)))
+    with pytest.raises(IndexError):
+        channel.publish((0, 0), (1, 0), (3,), np.zeros((4, 5)))
+    assert all(int(pose[0]) % 2 == 0 for pose in channel.poses)
+    channel.publish((1, 1), (0, 1), (3, 3), np.ones((4, 5)))
+    channel.publish((2, 2), (0, 1), (3, 3), np.ones((4, 5)))
+    state = channel.read()
+    assert (state.version, state.start) == (2, (2, 2))
+
+
+def test_read_times_out_on_a_slot_left_mid_write(channel):
+    channel.publish((1, 1), (0, 1), (3, 3), np.ones((4, 5)))
+    # writer stopped between its two increments of the slot counter
+    channel.poses[1][0] += 1
+    with pytest.raises(TimeoutError):
+        channel.snapshot(timeout=0.05)
+    with pytest.raises(TimeoutError):
+        channel.read(copy_grid=True, timeout=0.05)
+    channel.poses[1][0] += 1
+    assert channel.read(timeout=0.05).start == (1, 1)
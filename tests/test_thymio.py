@@ -0,0 +1,219 @@
+import socket
+import time
+import pytest
+from Thymio import FrameParser, Message, RemoteNode, Thymio
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def variables_message(offset, words, source_node=5):
+    return Message(Message.ID_VARIABLES, source_node, Message.uint16array_to_bytes([offset] + words))
+
+
+@pytest.fixture
+def node():
+    # Thymio connected to one end of a socket pair, the test plays the robot on the other end
+    th_end, node_end = socket.socketpair()
+    th = Thymio(th_end)
+    node_end.settimeout(0.2)
+    def send(*messages):
+        node_end.sendall(b"".join(msg.serialize() for msg in messages))
+    send(Message(Message.ID_NODE_PRESENT, 5, Message.uint16array_to_bytes([5])))
+    for name, size in [("leds.top", 3), ("motor.left.target", 1), ("motor.right.target", 1), ("acc", 3)]:
+        send(Message(Message.ID_NAMED_VARIABLE_DESCRIPTION, 5,
+                     Message.uint16array_to_bytes([size]) + bytes([len(name)]) + name.encode()))
+    assert wait_for(lambda: "acc" in th.remote_node.var_offset)
+    yield th, node_end, send
+    th.terminating = True
+    th.refreshing_trigger.set()
+    th.close()
+    node_end.close()
+    th.refresh_thread.join(1)
+
+
+def test_decode_variables():
+    msg = Message(Message.ID_VARIABLES, 5, variables_message(7, [1, 65535, 300]).payload)
+    msg.decode()
+    assert msg.var_offset == 7
+    assert bytes(msg.var_bytes) == Message.uint16array_to_bytes([1, 65535, 300])
+    assert msg.var_data == (1, 65535, 300)
+
+
+def test_variables_message_updates_node(node):
+    th, node_end, send = node
+    send(variables_message(5, [65535, 2, 3]))
+    assert wait_for(lambda: th.get_var("acc", 1) == 2)
+    assert th.get_var_array("acc") == [65535, 2, 3]
+    assert th.get_var("acc", 0, signed=True) == -1
+
+
+class ChunkIO:
+    # stream returning its data in chunks of at most `chunk` bytes
+    def __init__(self, data, chunk):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.chunk = chunk
+
+    def readinto(self, b):
+        n = min(len(b), self.chunk, len(self.data) - self.pos)
+        b[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def sample_messages():
+    return [variables_message(0, list(range(size))) for size in (0, 1, 3, 40, 600)] + [
+        Message(Message.ID_NODE_PRESENT, 5, Message.uint16array_to_bytes([9]))]
+
+
+def same_messages(a, b):
+    return [(m.id, m.source_node, m.payload) for m in a] == [(m.id, m.source_node, m.payload) for m in b]
+
+
+@pytest.mark.parametrize("chunk", [1, 5, 7, 4096])
+def test_frame_parser_split_frames(chunk):
+    # frames cut anywhere, including in the header, and larger than the initial buffer
+    messages = sample_messages()
+    stream = ChunkIO(b"".join(msg.serialize() for msg in messages), chunk)
+    parser = FrameParser(size=16)
+    received = []
+    while parser.fill(stream):
+        received += parser.messages()
+    assert same_messages(received, messages)
+    assert parser.end == parser.start
+
+
+def test_frame_parser_merged_frames():
+    messages = sample_messages()
+    data = b"".join(msg.serialize() for msg in messages)
+    parser = FrameParser()
+    parser.feed(data[:-1])
+    received = parser.messages()
+    assert same_messages(received, messages[:-1])
+    assert parser.pending_size() == len(messages[-1].serialize())
+    parser.feed(data[-1:])
+    assert same_messages(received + parser.messages(), messages)
+
+
+def test_signed_var_view():
+    node = RemoteNode()
+    node.add_var("a", 2)
+    node.add_var("b", 3)
+    node.reset_var_data()
+    unsigned = node.var_view("b")
+    signed = node.var_view("b", signed=True)
+    node.set_var_array("b", [-1, 32767, -32768])
+    assert list(unsigned) == [65535, 32767, 32768]
+    assert list(signed) == [-1, 32767, -32768]
+    node.set_var_bytes(2, Message.uint16array_to_bytes([65534, 1, 2]))
+    assert list(signed) == [-2, 1, 2]
+    assert node.get_var("b", 0, signed=True) == -2 and node.get_var("b", 0) == 65534
+    assert node.var_view("b", signed=True) is signed
+
+
+def test_merge_ranges():
+    assert Thymio.merge_ranges([]) == []
+    assert Thymio.merge_ranges([(10, 2), (0, 3)]) == [(0, 3), (10, 2)]
+    assert Thymio.merge_ranges([(0, 3), (5, 2), (6, 4)]) == [(0, 10)]
+    assert Thymio.merge_ranges([(0, 3), (7, 1)], max_gap=4) == [(0, 8)]
+    assert Thymio.merge_ranges([(0, 3), (8, 1)], max_gap=4) == [(0, 3), (8, 1)]
+    assert Thymio.merge_ranges([(0, 10), (2, 3)]) == [(0, 10)]
+
+
+def received_writes(node_end):
+    parser = FrameParser()
+    while True:
+        try:
+            data = node_end.recv(65536)
+        except socket.timeout:
+            break
+        parser.feed(data)
+    writes = []
+    for msg in parser.messages():
+        msg.decode()
+        if msg.id == Message.ID_SET_VARIABLES:
+            writes.append((msg.var_offset, list(msg.var_val)))
+    return writes
+
+
+def test_batch_merges_adjacent_writes(node):
+    th, node_end, send = node
+    received_writes(node_end)
+    th.set_vars({"motor.left.target": -5, "motor.right.target": 5})
+    assert received_writes(node_end) == [(3, [65531, 5])]
+    with th.batch():
+        th.set_var("motor.left.target", 1)
+        with th.batch():
+            th.set_var("motor.left.target", 2)
+            th.set_var("acc", 9, 2)
+        th.set_var_array("leds.top", [1, 2, 3])
+    assert received_writes(node_end) == [(0, [1, 2, 3, 2]), (7, [9])]
+    with pytest.raises(RuntimeError):
+        with th.batch():
+            th.set_var("motor.left.target", 3)
+            raise RuntimeError
+    assert received_writes(node_end) == []
+
+
+def test_write_queue_latest_value_wins(node):
+    th, node_end, send = node
+    received_writes(node_end)
+    th.set_write_queue(True)
+    # the link is busy: the writer thread holds the first write while new ones arrive
+    with th.output_lock:
+        th.set_var("motor.left.target", 100)
+        assert wait_for(lambda: th.sending_writes)
+        for speed in range(10):
+            th.set_vars({"motor.left.target": speed, "motor.right.target": -speed})
+    assert th.flush(2)
+    assert th.dropped_writes == 18
+    assert received_writes(node_end) == [(3, [100]), (3, [9, 65527])]
+    th.set_write_queue(False)
+    th.set_var("motor.left.target", 0)
+    assert received_writes(node_end) == [(3, [0])]
+
+
+def test_odd_length_variables_message(node):
+    # a trailing odd byte is ignored and does not stop the input thread
+    th, node_end, send = node
+    send(Message(Message.ID_VARIABLES, 5, Message.uint16array_to_bytes([5, 7]) + b"\x01"))
+    send(variables_message(6, [8]))
+    assert wait_for(lambda: th.get_var("acc", 1) == 8)
+    assert th.get_var("acc", 0) == 7
+    assert th.input_thread.is_alive()
+
+
+def test_views_stay_valid_after_var_space():
+    node = RemoteNode()
+    node.set_var_space(8)
+    node.add_var("a", 2)
+    view = node.var_view("a")
+    derived = view[0:1]
+    node.add_var("b", 3)
+    node.set_var_bytes(1, Message.uint16array_to_bytes([4, 5, 6]))
+    # past the variable space: ignored, the array is not resized
+    node.set_var_bytes(6, Message.uint16array_to_bytes([7, 8, 9, 10]))
+    node.set_var_data(7, [11, 12])
+    assert list(view) == [0, 4] and list(derived) == [0]
+    assert node.var_data.tolist() == [0, 4, 5, 6, 0, 0, 7, 11]
+    node.reset_var_data()
+    assert list(view) == [0, 0]
+
+
+def test_description_sets_var_space(node):
+    th, node_end, send = node
+    send(Message(Message.ID_DESCRIPTION, 5, bytes([6]) + b"thymio" + Message.uint16array_to_bytes([8, 1000, 32, 20, 4, 0, 0])))
+    assert wait_for(lambda: th.remote_node.var_space == 20)
+    view = th.var_view("acc", signed=True)
+    send(Message(Message.ID_NAMED_VARIABLE_DESCRIPTION, 5,
+                 Message.uint16array_to_bytes([2]) + bytes([3]) + b"new"))
+    send(variables_message(5, [65535, 2, 3]))
+    assert wait_for(lambda: list(view) == [-1, 2, 3])
+    assert th.input_thread.is_alive()
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+import pytest
+import vision_func
+
+
+def first_blob_inrange(HSV_blur, lower, upper):
+    # former color_mask selection: first RETR_TREE contour larger than 100 pixels of the closed inRange mask
+    mask = cv2.morphologyEx(cv2.inRange(HSV_blur, lower, upper), cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8), iterations=2)
+    contours, hierarchy = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
+    for contour in contours:
+        if cv2.contourArea(contour) > 100:
+            mom = cv2.moments(contour)
+            return mask, (int(mom['m10'] / mom['m00']), int(mom['m01'] / mom['m00']))
+    return mask, None
+
+
+def color_mask_inrange(img, offset_thymio):
+    HSV_blur = cv2.GaussianBlur(cv2.cvtColor(img, cv2.COLOR_RGB2HSV), (7, 7), 0)
+    obstacles_mask, _ = first_blob_inrange(HSV_blur, vision_func.red_lower, vision_func.red_upper)
+    _, goal = first_blob_inrange(HSV_blur, vision_func.yellow_lower, vision_func.yellow_upper)
+    _, forward = first_blob_inrange(HSV_blur, vision_func.green_lower, vision_func.green_upper)
+    _, hinter = first_blob_inrange(HSV_blur, vision_func.blue_lower, vision_func.blue_upper)
+    start_point, start_direction = vision_func.robot_pose(forward, hinter, offset_thymio)
+    return obstacles_mask, start_point, (goal[1], goal[0]), start_direction
+
+
+def hsv_color(lower, upper):
+    hsv = ((np.asarray(lower) + np.asarray(upper)) // 2).astype(np.uint8)
+    return cv2.cvtColor(hsv.reshape(1, 1, 3), cv2.COLOR_HSV2RGB)[0, 0].tolist()
+
+
+def cluttered_arena(seed):
+    # several blobs and rings of every marker color, so that the first and the largest blobs differ
+    rng = np.random.RandomState(seed)
+    colors = [hsv_color(lower, upper) for name, lower, upper in vision_func.arena_classes[:4]]
+    img = np.full((480, 640, 3), 200, np.uint8)
+    for k in range(16):
+        color = colors[k % 4]
+        x, y, r = rng.randint(0, 600), rng.randint(0, 440), rng.randint(6, 30)
+        if rng.rand() < 0.3:
+            cv2.circle(img, (x, y), r + 8, color, 5)
+        else:
+            cv2.rectangle(img, (x, y), (x + rng.randint(4, 40), y + rng.randint(4, 40)), color, -1)
+    return np.clip(img.astype(np.int16) + rng.randint(-6, 7, img.shape), 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_color_mask_matches_inrange(seed):
+    img = cluttered_arena(seed)
+    expected = color_mask_inrange(img, (9, 25))
+    result = vision_func.color_mask(img, (9, 25))
+    assert np.array_equal(result[0], expected[0])
+    assert result[1:] == expected[1:]
+
+
+def test_corner_class_matches_inrange():
+    img = np.full((480, 640, 3), 90, np.uint8)
+    pink = hsv_color(vision_func.pink_lower, vision_func.pink_upper)
+    for center in [(40, 30), (600, 40), (30, 450), (610, 440)]:
+        cv2.circle(img, center, 12, pink, -1)
+    HSV_blur = cv2.GaussianBlur(cv2.cvtColor(img, cv2.COLOR_RGB2HSV), (7, 7), 0)
+    labels = vision_func.classify_colors(HSV_blur, vision_func.arena_lut)
+    corner = cv2.LUT(labels, vision_func.arena_plane_luts[4])
+    assert np.array_equal(corner, cv2.inRange(HSV_blur, vision_func.pink_lower, vision_func.pink_upper))
+    assert vision_func.detect_corners(img) == [(40, 30), (600, 40), (30, 450), (610, 440)]
+
+
+def obstacles(seed, rows=480, cols=640, n=5):
+    rng = np.random.RandomState(seed)
+    mask = np.zeros((rows, cols), np.uint8)
+    for _ in range(n):
+        y, x = rng.randint(0, rows - 40), rng.randint(0, cols - 40)
+        mask[y:y + rng.randint(15, 60), x:x + rng.randint(15, 60)] = 255
+    return mask
+
+
+@pytest.mark.parametrize("grid_size", [4, 2.5, 3])
+def test_obstacle_map_matches_rasterize(grid_size):
+    # with 2.5 or 3 cm cells the pixels per cell are not integers: the last rows and columns are past the cells
+    obstacle_map = vision_func.ObstacleMap(42, 80, 56, grid_size)
+    start_point, end_point = (240, 100), (100, 500)
+    for seed in range(4):
+        mask = obstacles(seed)
+        # obstacles along the bottom and right borders, inside the margins
+        mask[470:, 300 + 40 * seed:340 + 40 * seed] = 255
+        mask[100 + 60 * seed:140 + 60 * seed, 630:] = 255
+        obstacle_map.update(mask)
+        dilated = vision_func.dilate_obstacle(mask, 42)
+        expected = vision_func.rasterize(dilated, 80, 56, grid_size, start_point, end_point)
+        result = obstacle_map.rasterize(start_point, end_point)
+        assert np.array_equal(result[0], expected[0])
+        assert np.array_equal(result[1], expected[1])
+        assert result[2:] == expected[2:]
+    assert obstacle_map.partial_updates == 3
+
+
+def test_inflate_obstacle_clearance_cost():
+    mask = np.zeros((480, 640), np.uint8)
+    mask[150:330, 250:390] = 255
+    inflated, clearance_cost = vision_func.inflate_obstacle(mask, 42, cost_margin=60)
+    assert np.all(clearance_cost[inflated == 255] == 255)
+    assert clearance_cost[240, 320 + 69 + 41 + 61] == 0
+    with pytest.raises(ValueError):
+        vision_func.inflate_obstacle(mask, 42, cost_margin=0)
+    costs = vision_func.cell_costs(clearance_cost, 80, 56, 4)
+    grid = vision_func.rasterize(inflated, 80, 56, 4, (0, 0), (0, 0))[1]
+    assert costs.shape == grid.shape
+    assert np.all(costs[grid == 1] == 1.0) and costs.min() == 0.0
@@ -29,10 +29,10 @@ green_upper = np.array([60, 175, 132])
 blue_lower = np.array([15, 175, 110])
 blue_upper = np.array([25, 230, 165])
 
-def transform_img(frame):
+def detect_corners(frame):
     HSV = cv2.cvtColor(frame, cv2.COLOR_RGB2HSV)
     HSV_blur = cv2.GaussianBlur(HSV, (7, 7), 0)
-    pink_mask=cv2.inRange(HSV_blur,pink_lower,pink_upper)
+    pink_mask=cv2.LUT(classify_colors(HSV_blur,corner_lut),arena_plane_luts[0])
     pink_mask[70:350,:]=0 #remove the red which is similar to pink corners
     pink_mask[:,100:500]=0 #remove the red which is similar to pink corners
     contours, hierarchy = cv2.findContours(pink_mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)  # for opencv3.4
@@ -44,84 +44,502 @@ def transform_img(frame):
     if len(corner_points) != 4:
         print("failure in identifying corners")
         print(corner_points)
+        return corner_points
     corner_points=sorted(corner_points, key=lambda x: (int(x[1]), int(x[0]))) #topleft,topright,bottomleft,bottomright
     if corner_points[0][0] > corner_points[1][0]:
         corner_points[0], corner_points[1] = corner_points[1], corner_points[0]
     if corner_points[2][0] > corner_points[3][0]:
         corner_points[2], corner_points[3] = corner_points[3], corner_points[2]
+    return corner_points
+
+def transform_img(frame):
+    corner_points = detect_corners(frame)
     pts1 = np.float32(corner_points)
     pts2 = np.float32([[0, 0], [640, 0], [0, 480], [640, 480]])
     transform = cv2.getPerspectiveTransform(pts1, pts2)
     warpedimg = cv2.warpPerspective(frame, transform, (640, 480))
     return warpedimg
 
-def color_mask(warpedimg,offset_thymio):
-    HSV_warped = cv2.cvtColor(warpedimg, cv2.COLOR_RGB2HSV)
-    HSV_warped_blur = cv2.GaussianBlur(HSV_warped, (7, 7), 0)
-    
-    red_mask_open=cv2.inRange(HSV_warped_blur,red_lower,red_upper)
-    obstacles_mask = cv2.morphologyEx(red_mask_open, cv2.MORPH_CLOSE, np.ones((5,5), np.uint8),iterations=2)
-    
-    yellow_mask_open=cv2.inRange(HSV_warped_blur,yellow_lower,yellow_upper)
-    yellow_mask_closed = cv2.morphologyEx(yellow_mask_open, cv2.MORPH_CLOSE, np.ones((5,5), np.uint8),iterations=2)
-    contours, hierarchy = cv2.findContours(yellow_mask_closed, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)  # for opencv3.4
-    for i in range(len(contours)):
-        if (cv2.contourArea(contours[i]) > 100):
-            mom = cv2.moments(contours[i])
-            end_point=(int(mom['m01'] / mom['m00']),int(mom['m10'] / mom['m00']))
-            break
+def build_warp_maps(corner_points, frame_size, mtx=None, dist=None, out_size=(640, 480)):
+    # remap table from the warped image to the raw frame, undistortion included
+    pts1 = np.float32(corner_points)
+    pts2 = np.float32([[0, 0], [out_size[0], 0], [0, out_size[1]], [out_size[0], out_size[1]]])
+    inv_transform = cv2.getPerspectiveTransform(pts2, pts1)
+    u, v = np.meshgrid(np.arange(out_size[0], dtype=np.float32), np.arange(out_size[1], dtype=np.float32))
+    warp_pts = cv2.perspectiveTransform(np.dstack([u, v]).reshape(-1, 1, 2), inv_transform)
+    map_x = warp_pts[:, 0, 0].reshape(out_size[1], out_size[0])
+    map_y = warp_pts[:, 0, 1].reshape(out_size[1], out_size[0])
+    if mtx is not None:
+        # same as cv2.undistort(frame, mtx, dist, None, mtx) followed by the warp
+        undist_x, undist_y = cv2.initUndistortRectifyMap(mtx, dist, None, mtx, frame_size, cv2.CV_32FC1)
+        map_x, map_y = (cv2.remap(undist_x, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE),
+                        cv2.remap(undist_y, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE))
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
 
-    green_mask_open = cv2.inRange(HSV_warped_blur,green_lower,green_upper)
-    green_mask_closed = cv2.morphologyEx(green_mask_open, cv2.MORPH_CLOSE, np.ones((5,5), np.uint8),iterations=2)
-    contours, hierarchy = cv2.findContours(green_mask_closed, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)  # for opencv3.4
-    for i in range(len(contours)):
-        if (cv2.contourArea(contours[i]) > 100):
-            mom = cv2.moments(contours[i])
-            start_point_forward=(int(mom['m10'] / mom['m00']), int(mom['m01'] / mom['m00']))
-            break
-            
-    blue_mask_open = cv2.inRange(HSV_warped_blur,blue_lower,blue_upper)
-    blue_mask_closed = cv2.morphologyEx(blue_mask_open, cv2.MORPH_CLOSE, np.ones((5,5), np.uint8),iterations=2)
-    contours, hierarchy = cv2.findContours(blue_mask_closed, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)  # for opencv3.4
-    for i in range(len(contours)):
-        if (cv2.contourArea(contours[i]) > 100):
-            mom = cv2.moments(contours[i])
-            start_point_hinter=(int(mom['m10'] / mom['m00']), int(mom['m01'] / mom['m00']))
-            break
-    
+class FixedCameraWarper:
+    """Undistort and warp frames of a fixed camera with a single remap.
+
+    Corners are re-detected every `redetect_every` frames (never if None) or
+    when the pink patches are no longer found at the cached corner positions.
+    """
+
+    def __init__(self, mtx=None, dist=None, redetect_every=None, check_every=10,
+                 check_radius=6, check_ratio=0.3, out_size=(640, 480)):
+        self.mtx = mtx
+        self.dist = dist
+        self.redetect_every = redetect_every
+        self.check_every = check_every
+        self.check_radius = check_radius
+        self.check_ratio = check_ratio
+        self.out_size = out_size
+        self.maps = None
+        self.corner_points = None
+        self.raw_corner_points = None
+        self.frame_count = 0
+        self.calibration_count = 0
+
+    def calibrate(self, frame):
+        """Detect the corners and rebuild the remap table.
+        """
+        undistorted = frame if self.mtx is None else cv2.undistort(frame, self.mtx, self.dist, None, self.mtx)
+        corner_points = detect_corners(undistorted)
+        if len(corner_points) != 4:
+            return False
+        frame_size = (frame.shape[1], frame.shape[0])
+        self.maps = build_warp_maps(corner_points, frame_size, self.mtx, self.dist, self.out_size)
+        self.corner_points = corner_points
+        if self.mtx is None:
+            self.raw_corner_points = np.float32(corner_points)
+        else:
+            # corners are found in the undistorted image, the drift check looks at the raw frame
+            undist_x, undist_y = cv2.initUndistortRectifyMap(self.mtx, self.dist, None, self.mtx, frame_size, cv2.CV_32FC1)
+            self.raw_corner_points = np.float32([(undist_x[y, x], undist_y[y, x]) for (x, y) in corner_points])
+        self.calibration_count += 1
+        return True
+
+    def corners_drifted(self, frame):
+        """Check that the pink patches are still under the cached corner positions.
+        """
+        r = self.check_radius
+        rows, cols = frame.shape[:2]
+        for (x, y) in self.raw_corner_points.astype(int):
+            patch = frame[max(y-r, 0):min(y+r+1, rows), max(x-r, 0):min(x+r+1, cols)]
+            if patch.size == 0:
+                return True
+            pink = cv2.inRange(cv2.cvtColor(patch, cv2.COLOR_RGB2HSV), pink_lower, pink_upper)
+            if cv2.countNonZero(pink) < self.check_ratio * pink.size:
+                return True
+        return False
+
+    def warp(self, frame):
+        """Undistort and warp a raw frame.
+        """
+        redetect = self.maps is None
+        if not redetect and self.redetect_every and self.frame_count % self.redetect_every == 0:
+            redetect = True
+        if not redetect and self.check_every and self.frame_count % self.check_every == 0:
+            redetect = self.corners_drifted(frame)
+        if redetect and not self.calibrate(frame) and self.maps is None:
+            raise RuntimeError("arena corners not found")
+        self.frame_count += 1
+        return cv2.remap(frame, self.maps[0], self.maps[1], cv2.INTER_LINEAR)
+
+    __call__ = warp
+
+# arena classes of the label image, class k is bit k
+# (rebuild arena_lut with build_color_lut after changing the bounds above)
+arena_classes = [
+    ('obstacle', red_lower, red_upper),
+    ('goal', yellow_lower, yellow_upper),
+    ('robot_front', green_lower, green_upper),
+    ('robot_back', blue_lower, blue_upper),
+    ('corner', pink_lower, pink_upper),
+]
+
+def build_color_lut(classes):
+    # one 256 entry table per HSV channel, bit k is set where the value is inside the bounds of class k
+    assert len(classes) <= 8, "at most 8 classes fit in the uint8 label image"
+    lut = np.zeros((3, 256), np.uint8)
+    values = np.arange(256)
+    for k, (name, lower, upper) in enumerate(classes):
+        for c in range(3):
+            lut[c, (values >= lower[c]) & (values <= upper[c])] |= 1 << k
+    return lut
+
+arena_lut = build_color_lut(arena_classes)
+corner_lut = build_color_lut(arena_classes[4:])
+
+def classify_colors(HSV, lut):
+    # label image where bit k is set for pixels of class k, 0 is free space
+    h, s, v = cv2.split(HSV)
+    labels = cv2.LUT(h, lut[0])
+    cv2.bitwise_and(labels, cv2.LUT(s, lut[1]), dst=labels)
+    cv2.bitwise_and(labels, cv2.LUT(v, lut[2]), dst=labels)
+    return labels
+
+def class_plane_luts(n_classes):
+    # tables turning the label image into the 0/255 mask of one class
+    values = np.arange(256)
+    return [np.where((values >> k) & 1, 255, 0).astype(np.uint8) for k in range(n_classes)]
+
+arena_plane_luts = class_plane_luts(len(arena_classes))
+
+def segment_arena(img, classes=None, lut=None, min_area=100, close_iterations=2, blur_size=7, close_size=5,
+                  largest_first=True):
+    # classify every pixel once, then extract the blobs of each class from the label image
+    # returns the label image, the closed mask of each class and for each class the
+    # (centroid (x, y), area) of its blobs larger than min_area, largest first,
+    # or without largest_first all the contours (holes included) in findContours order
+    # closing and contours only run around the pixels of the class, most classes are a few small blobs
+    if classes is None:
+        classes, lut = arena_classes, arena_lut
+    elif lut is None:
+        lut = build_color_lut(classes)
+    HSV = cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
+    HSV_blur = cv2.GaussianBlur(HSV, (blur_size, blur_size), 0) if blur_size > 1 else HSV
+    labels = classify_colors(HSV_blur, lut)
+    plane_luts = arena_plane_luts if len(classes) <= len(arena_plane_luts) else class_plane_luts(len(classes))
+    closing = close_iterations and close_size > 1
+    # the closing grows a blob by at most reach pixels, then must not see the window border when eroding
+    reach = close_iterations * (close_size // 2) if closing else 0
+    rows, cols = labels.shape
+    masks = {}
+    blobs = {}
+    for k, (name, lower, upper) in enumerate(classes):
+        mask = cv2.LUT(labels, plane_luts[k])
+        masks[name] = mask
+        blobs[name] = []
+        x, y, w, h = cv2.boundingRect(mask)
+        if w == 0:
+            continue
+        x0, y0 = max(x - 2 * reach - 1, 0), max(y - 2 * reach - 1, 0)
+        x1, y1 = min(x + w + 2 * reach + 1, cols), min(y + h + 2 * reach + 1, rows)
+        if closing:
+            mask[y0:y1, x0:x1] = cv2.morphologyEx(mask[y0:y1, x0:x1], cv2.MORPH_CLOSE, np.ones((close_size,close_size), np.uint8), iterations=close_iterations)
+        if largest_first:
+            contours, hierarchy = cv2.findContours(mask[y0:y1, x0:x1], cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
+        else:
+            contours, hierarchy = cv2.findContours(mask[y0:y1, x0:x1], cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE, offset=(x0, y0))
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area > min_area:
+                mom = cv2.moments(contour)
+                blobs[name].append(((mom['m10'] / mom['m00'], mom['m01'] / mom['m00']), area))
+        if largest_first:
+            blobs[name].sort(key=lambda blob: -blob[1])
+    return labels, masks, blobs
+
+def robot_pose(start_point_forward,start_point_hinter,offset_thymio):
+    # marker centroids (x, y) to the (row, col) center of Thymio and its direction vector
     start_point = (int((start_point_forward[1] + start_point_hinter[1])/2 + offset_thymio[1]) , int((start_point_forward[0] + start_point_hinter[0])/2 + offset_thymio[0]))
     start_direction = (start_point_forward[1] - start_point_hinter[1], start_point_forward[0] - start_point_hinter[0])
+    return start_point,start_direction
+
+def color_mask(warpedimg,offset_thymio):
+    # first contour of each marker color larger than 100 pixels, as the former inRange version
+    labels, masks, blobs = segment_arena(warpedimg, arena_classes[:4], arena_lut, largest_first=False)
+    obstacles_mask = masks['obstacle']
+    (x, y), area = blobs['goal'][0]
+    end_point = (int(y), int(x))
+    (x, y), area = blobs['robot_front'][0]
+    start_point_forward = (int(x), int(y))
+    (x, y), area = blobs['robot_back'][0]
+    start_point_hinter = (int(x), int(y))
+    start_point,start_direction = robot_pose(start_point_forward,start_point_hinter,offset_thymio)
     return(obstacles_mask,start_point,end_point,start_direction)
 
-def dilate_obstacle(obstacles_mask,ext_pixels):  
+marker_classes = [arena_classes[2], arena_classes[3]]
+marker_lut = build_color_lut(marker_classes)
+
+def find_markers(img, x0=0, y0=0):
+    # largest green and blue blobs of img as (x, y) centroids, img being a window at (x0, y0)
+    labels, masks, blobs = segment_arena(img, marker_classes, marker_lut)
+    if not blobs['robot_front'] or not blobs['robot_back']:
+        return None
+    (xf, yf), area = blobs['robot_front'][0]
+    (xh, yh), area = blobs['robot_back'][0]
+    return (int(xf + x0), int(yf + y0)), (int(xh + x0), int(yh + y0))
+
+class MarkerTracker:
+    """Track the green and blue Thymio markers in a window around their last position.
+
+    The window grows by `grow` each time a marker is missing and the whole image
+    is searched once it exceeds `max_window` (e.g. after a kidnapping).
+    """
+
+    def __init__(self, offset_thymio, margin=40, grow=2, max_window=240):
+        self.offset_thymio = offset_thymio
+        self.margin = margin
+        self.grow = grow
+        self.max_window = max_window
+        self.forward = None
+        self.hinter = None
+        self.full_searches = 0
+        self.window_searches = 0
+
+    def reset(self):
+        """Forget the last position, the next update searches the whole image.
+        """
+        self.forward = None
+        self.hinter = None
+
+    def update(self, warpedimg):
+        """Locate the markers, return (start_point, start_direction) or None if not found.
+        """
+        rows, cols = warpedimg.shape[:2]
+        found = None
+        if self.forward is not None:
+            cx = (self.forward[0] + self.hinter[0]) // 2
+            cy = (self.forward[1] + self.hinter[1]) // 2
+            half = max(abs(self.forward[0] - self.hinter[0]), abs(self.forward[1] - self.hinter[1])) // 2 + self.margin
+            while found is None and half <= self.max_window:
+                x0, y0 = max(cx - half, 0), max(cy - half, 0)
+                window = warpedimg[y0:min(cy + half, rows), x0:min(cx + half, cols)]
+                self.window_searches += 1
+                found = find_markers(window, x0, y0)
+                half *= self.grow
+        if found is None:
+            self.full_searches += 1
+            found = find_markers(warpedimg)
+        if found is None:
+            self.reset()
+            return None
+        self.forward, self.hinter = found
+        return robot_pose(self.forward, self.hinter, self.offset_thymio)
+
+def near_cell_boundary(point, grid, margin):
+    # True if a (row, col) pixel position is within margin pixels of a grid line
+    # grid is (rows, cols, real_width, real_height, grid_size) of the full resolution image
+    rows, cols, real_width, real_height, grid_size = grid
+    grid_size_h = rows*grid_size/real_height
+    grid_size_w = cols*grid_size/real_width
+    for p, size in ((point[0], grid_size_h), (point[1], grid_size_w)):
+        offset = p % size
+        if offset < margin or size - offset < margin:
+            return True
+    return False
+
+def color_mask_pyramid(warpedimg,offset_thymio,scale=2,refine=True,grid=None,refine_half=24):
+    # color_mask on an image downscaled by scale, centroids are mapped back to full resolution
+    # with refine, the robot markers are located again at full resolution in a small window,
+    # only when the coarse pose is close to a cell boundary if grid (real_width, real_height, grid_size) is given
+    if scale == 1:
+        return color_mask(warpedimg,offset_thymio)
+    rows, cols = warpedimg.shape[:2]
+    small = cv2.resize(warpedimg, (cols // scale, rows // scale), interpolation=cv2.INTER_AREA)
+    # contour areas run through the boundary pixel centers, so a blob of side 10/scale loses about one pixel of side
+    labels, masks, blobs = segment_arena(small, arena_classes[:4], arena_lut, min_area=(10 / scale - 1)**2,
+                                         blur_size=(7 // scale) | 1, close_size=(5 // scale) | 1)
+    obstacles_mask = cv2.resize(masks['obstacle'], (cols, rows), interpolation=cv2.INTER_NEAREST)
+    (x, y), area = blobs['goal'][0]
+    end_point = (int(y * scale), int(x * scale))
+    (x, y), area = blobs['robot_front'][0]
+    start_point_forward = (int(x * scale), int(y * scale))
+    (x, y), area = blobs['robot_back'][0]
+    start_point_hinter = (int(x * scale), int(y * scale))
+    start_point,start_direction = robot_pose(start_point_forward,start_point_hinter,offset_thymio)
+    if refine and (grid is None or near_cell_boundary(start_point, (rows, cols) + tuple(grid), 2 * scale)):
+        cx = (start_point_forward[0] + start_point_hinter[0]) // 2
+        cy = (start_point_forward[1] + start_point_hinter[1]) // 2
+        half = max(abs(start_point_forward[0] - start_point_hinter[0]), abs(start_point_forward[1] - start_point_hinter[1])) // 2 + refine_half
+        x0, y0 = max(cx - half, 0), max(cy - half, 0)
+        found = find_markers(warpedimg[y0:min(cy + half, rows), x0:min(cx + half, cols)], x0, y0)
+        if found is not None:
+            start_point,start_direction = robot_pose(found[0],found[1],offset_thymio)
+    return(obstacles_mask,start_point,end_point,start_direction)
+
+def filter_obstacles(obstacles_mask):
     contours, hierarchy = cv2.findContours(obstacles_mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
     delete_list = []
     for i in range(len(contours)):
         if (cv2.contourArea(contours[i]) < 100):
             delete_list.append(i)
-    contours = delet_contours(contours, delete_list)
-    obstacles_mask_filtered = mask_from_contours(obstacles_mask,contours)
-    obstacles_mask_dilated = cv2.dilate(obstacles_mask_filtered, np.ones((int(ext_pixels*2-1),int(ext_pixels*2-1)), np.uint8), iterations=1)
+    contours = delet_contours(list(contours), delete_list)
+    return mask_from_contours(obstacles_mask,contours)
+
+def add_walls(obstacles_mask_dilated):
     obstacles_mask_dilated[:6,:] = 255;
     obstacles_mask_dilated[:,:6] = 255;
     obstacles_mask_dilated[:,-1:-7:-1] = 255;
     obstacles_mask_dilated[-1:-7:-1,:] = 255; #add walls
-    return(obstacles_mask_dilated)
+    return obstacles_mask_dilated
 
-def rasterize(obstacles_mask_dilated,real_width,real_height,grid_size,start_point,end_point):
-    grid_output = obstacles_mask_dilated.copy()
-    rows,cols = grid_output.shape
+def dilate_obstacle(obstacles_mask,ext_pixels):  
+    obstacles_mask_filtered = filter_obstacles(obstacles_mask)
+    obstacles_mask_dilated = cv2.dilate(obstacles_mask_filtered, np.ones((int(ext_pixels*2-1),int(ext_pixels*2-1)), np.uint8), iterations=1)
+    return(add_walls(obstacles_mask_dilated))
+
+def obstacle_distance(obstacles_mask_filtered):
+    # exact euclidean distance of every pixel to the nearest obstacle pixel
+    return cv2.distanceTransform(cv2.bitwise_not(obstacles_mask_filtered), cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+
+def inflate_obstacle(obstacles_mask,ext_pixels,cost_margin=None):
+    # circular inflation by ext_pixels-1 from the distance to the nearest obstacle,
+    # the square kernel of dilate_obstacle over-inflates along the diagonals
+    # with cost_margin, also return a uint8 clearance cost: 255 in the inflated obstacles,
+    # decreasing linearly to 0 at cost_margin pixels further
+    obstacles_mask_filtered = filter_obstacles(obstacles_mask)
+    dist = obstacle_distance(obstacles_mask_filtered)
+    radius = int(ext_pixels*2-1)//2
+    obstacles_mask_inflated = add_walls(np.where(dist <= radius, 255, 0).astype(np.uint8))
+    if cost_margin is None:
+        return obstacles_mask_inflated
+    if cost_margin <= 0:
+        raise ValueError("cost_margin must be positive")
+    clearance_cost = np.clip((radius + cost_margin - dist) * (254.0 / cost_margin), 0, 254).astype(np.uint8)
+    clearance_cost[obstacles_mask_inflated == 255] = 255
+    return obstacles_mask_inflated, clearance_cost
+
+def grid_edges(shape,real_width,real_height,grid_size):
+    rows,cols = shape
     grid_size_h = rows*grid_size/real_height #make sure this to be fully 
     grid_size_w = cols*grid_size/real_width
-    grid_array_output = np.zeros([int(real_height/grid_size),int(real_width/grid_size)])
+    # pixel boundaries of every cell, same truncation as int(i*grid_size_h)
+    row_edges = (np.arange(int(real_height/grid_size)+1)*grid_size_h).astype(int)
+    col_edges = (np.arange(int(real_width/grid_size)+1)*grid_size_w).astype(int)
+    return row_edges,col_edges,grid_size_h,grid_size_w
+
+def block_occupancy(mask,row_edges,col_edges):
+    # a block is occupied when its pixels sum to at least 255, all blocks at once from the integral image
+    integral = cv2.integral(mask)
+    block_sum = (integral[row_edges[1:]][:,col_edges[1:]] - integral[row_edges[:-1]][:,col_edges[1:]]
+                 - integral[row_edges[1:]][:,col_edges[:-1]] + integral[row_edges[:-1]][:,col_edges[:-1]])
+    return block_sum >= 255
+
+def paint_cells(grid_output,occupied,row_edges,col_edges):
+    # paint every pixel covered by the cells with the value of its cell
+    cell_img = np.where(occupied, 255, 0).astype(grid_output.dtype)
+    cell_img = np.repeat(np.repeat(cell_img, np.diff(row_edges), axis=0), np.diff(col_edges), axis=1)
+    grid_output[row_edges[0]:row_edges[-1],col_edges[0]:col_edges[-1]] = cell_img
+
+def block_max(img,row_edges,col_edges):
+    # maximum of every block, e.g. the cost of a cell from the clearance cost image
+    return np.maximum.reduceat(np.maximum.reduceat(img[:row_edges[-1],:col_edges[-1]], row_edges[:-1], axis=0),
+                               col_edges[:-1], axis=1)
+
+def cell_costs(clearance_cost,real_width,real_height,grid_size):
+    # cost in [0, 1] of every cell for the cell_cost of planner.astar: the highest clearance cost of its pixels
+    row_edges,col_edges,grid_size_h,grid_size_w = grid_edges(clearance_cost.shape,real_width,real_height,grid_size)
+    return block_max(clearance_cost,row_edges,col_edges) / 255.0
+
+def rasterize(obstacles_mask_dilated,real_width,real_height,grid_size,start_point,end_point):
+    grid_output = obstacles_mask_dilated.copy()
+    row_edges,col_edges,grid_size_h,grid_size_w = grid_edges(grid_output.shape,real_width,real_height,grid_size)
     grid_array_start = (int(start_point[0]//grid_size_h),int(start_point[1]//grid_size_w))
     grid_array_end = (int(end_point[0]//grid_size_h),int(end_point[1]//grid_size_w)) 
-    for i in range(0,int(real_height/grid_size)):
-        for j in range(0, int(real_width/grid_size)):
-            sum = np.sum(grid_output[int(i*grid_size_h):int((i+1)*grid_size_h),int(j*grid_size_w):int((j+1)*grid_size_w)])
-            if (sum >= 255 ): 
-                grid_output[int(i*grid_size_h):int((i+1)*grid_size_h),int(j*grid_size_w):int((j+1)*grid_size_w)] = 255
-                grid_array_output[i,j] = 1;
-            else:
-                grid_output[int(i*grid_size_h):int((i+1)*grid_size_h),int(j*grid_size_w):int((j+1)*grid_size_w)] = 0
-    return(grid_output,grid_array_output,grid_array_start,grid_array_end)
\ No newline at end of file
+    occupied = block_occupancy(grid_output,row_edges,col_edges)
+    grid_array_output = occupied.astype(np.float64)
+    paint_cells(grid_output,occupied,row_edges,col_edges)
+    return(grid_output,grid_array_output,grid_array_start,grid_array_end)
+
+class ObstacleMap:
+    """Dilated and rasterized obstacle map updated only where the obstacles changed.
+
+    The filtered obstacle mask is compared tile by tile with the previous one;
+    changed tiles are re-dilated and re-rasterized with the margin of the dilation
+    kernel. `version` is increased each time the occupancy grid changes.
+    With `circular`, obstacles are inflated by a disc as in inflate_obstacle.
+    """
+
+    def __init__(self, ext_pixels, real_width, real_height, grid_size, tile=32, circular=False):
+        self.circular = circular
+        self.kernel_size = int(ext_pixels*2-1)
+        self.kernel = np.ones((self.kernel_size, self.kernel_size), np.uint8)
+        self.real_width = real_width
+        self.real_height = real_height
+        self.grid_size = grid_size
+        self.tile = tile
+        self.filtered = None
+        self.dilated = None
+        self.grid_output = None
+        self.grid_array_output = None
+        self.version = 0
+        self.full_updates = 0
+        self.partial_updates = 0
+
+    def inflate(self, filtered):
+        if self.circular:
+            return np.where(obstacle_distance(filtered) <= self.kernel_size // 2, 255, 0).astype(np.uint8)
+        return cv2.dilate(filtered, self.kernel, iterations=1)
+
+    def full_update(self, filtered):
+        self.dilated = add_walls(self.inflate(filtered))
+        self.row_edges, self.col_edges, self.grid_size_h, self.grid_size_w = grid_edges(
+            filtered.shape, self.real_width, self.real_height, self.grid_size)
+        rows, cols = filtered.shape
+        self.tile_row_edges = np.append(np.arange(0, rows, self.tile), rows)
+        self.tile_col_edges = np.append(np.arange(0, cols, self.tile), cols)
+        self.grid_output = self.dilated.copy()
+        occupied = block_occupancy(self.grid_output, self.row_edges, self.col_edges)
+        self.grid_array_output = occupied.astype(np.float64)
+        paint_cells(self.grid_output, occupied, self.row_edges, self.col_edges)
+        self.full_updates += 1
+        return True
+
+    def update_region(self, y0, y1, x0, x1):
+        # re-dilate the pixels [y0:y1, x0:x1] and re-grid the cells overlapping them
+        rows, cols = self.filtered.shape
+        reach = self.kernel_size // 2
+        wy0, wy1, wx0, wx1 = max(y0 - reach, 0), min(y1 + reach, rows), max(x0 - reach, 0), min(x1 + reach, cols)
+        window = self.inflate(self.filtered[wy0:wy1, wx0:wx1])
+        self.dilated[y0:y1, x0:x1] = window[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0]
+        add_walls(self.dilated)
+        # pixels past the last cell (pixels per cell not an integer) keep the dilated mask, as in rasterize
+        ry, cx = self.row_edges[-1], self.col_edges[-1]
+        if y1 > ry:
+            self.grid_output[max(y0, ry):y1, x0:x1] = self.dilated[max(y0, ry):y1, x0:x1]
+        if x1 > cx:
+            self.grid_output[y0:y1, max(x0, cx):x1] = self.dilated[y0:y1, max(x0, cx):x1]
+        i0 = max(np.searchsorted(self.row_edges, y0, side='right') - 1, 0)
+        i1 = min(np.searchsorted(self.row_edges, y1 - 1, side='right'), len(self.row_edges) - 1)
+        j0 = max(np.searchsorted(self.col_edges, x0, side='right') - 1, 0)
+        j1 = min(np.searchsorted(self.col_edges, x1 - 1, side='right'), len(self.col_edges) - 1)
+        if i0 >= i1 or j0 >= j1:
+            return False
+        row_edges = self.row_edges[i0:i1+1]
+        col_edges = self.col_edges[j0:j1+1]
+        occupied = block_occupancy(self.dilated, row_edges, col_edges)
+        old = self.grid_array_output[i0:i1, j0:j1] == 1
+        if np.array_equal(occupied, old):
+            return False
+        self.grid_array_output[i0:i1, j0:j1] = occupied
+        paint_cells(self.grid_output, occupied, row_edges, col_edges)
+        return True
+
+    def update(self, obstacles_mask):
+        """Update the map with a new obstacle mask, return True if the occupancy grid changed.
+        """
+        filtered = filter_obstacles(obstacles_mask)
+        if self.filtered is None or self.filtered.shape != filtered.shape:
+            self.filtered = filtered
+            changed = self.full_update(filtered)
+        else:
+            diff = cv2.compare(filtered, self.filtered, cv2.CMP_NE)
+            if not cv2.countNonZero(diff):
+                return False
+            self.filtered = filtered
+            changed_tiles = block_occupancy(diff, self.tile_row_edges, self.tile_col_edges).astype(np.uint8)
+            # group the changed tiles whose dilation margins overlap
+            reach_tiles = -(-(self.kernel_size // 2) // self.tile)
+            grouped = cv2.dilate(changed_tiles, np.ones((2*reach_tiles+1, 2*reach_tiles+1), np.uint8))
+            n, _, stats, _ = cv2.connectedComponentsWithStats(grouped, connectivity=8)
+            changed = False
+            for k in range(1, n):
+                tx, ty, tw, th = stats[k, :4]
+                changed |= self.update_region(self.tile_row_edges[ty], self.tile_row_edges[ty + th],
+                                              self.tile_col_edges[tx], self.tile_col_edges[tx + tw])
+            self.partial_updates += 1
+        if changed:
+            self.version += 1
+        return changed
+
+    def grid_point(self, point):
+        """Convert a (row, col) pixel position to its grid cell.
+        """
+        return (int(point[0]//self.grid_size_h), int(point[1]//self.grid_size_w))
+
+    def rasterize(self, start_point, end_point):
+        """Same outputs as vision_func.rasterize for the current map.
+        """
+        return (self.grid_output, self.grid_array_output,
+                self.grid_point(start_point), self.grid_point(end_point))